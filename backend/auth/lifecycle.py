@@ -0,0 +1,95 @@
+'''Жизненный цикл сессий: лимит на пользователя и очистка просроченных.
+
+Очистка удаляет просроченные строки пачками по SESSION_SWEEP_BATCH с
+коммитом после каждой, поэтому блокировки короткие. Функция auth
+запускает её при прогреве (в том числе по таймерному триггеру) не чаще
+раза в SESSION_SWEEP_INTERVAL секунд на экземпляр и с бюджетом времени,
+а не во время входа; для cron есть запуск `python lifecycle.py`.
+'''
+import json
+import os
+import time
+
+MAX_PER_USER = int(os.environ.get('SESSION_MAX_PER_USER', '10'))
+SWEEP_BATCH = int(os.environ.get('SESSION_SWEEP_BATCH', '500'))
+SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', '600'))
+SWEEP_BUDGET = float(os.environ.get('SESSION_SWEEP_BUDGET_MS', '100')) / 1000
+
+_next_sweep = 0.0
+
+
+def enforce_cap(cur, schema: str, user_id: int, max_sessions: int = MAX_PER_USER) -> int:
+    '''Удаляет самые старые сессии пользователя сверх лимита'''
+    cur.execute(
+        f"DELETE FROM {schema}.sessions WHERE user_id = %s AND id NOT IN ("
+        f"SELECT id FROM {schema}.sessions WHERE user_id = %s "
+        f"ORDER BY expires_at DESC LIMIT %s)",
+        (user_id, user_id, max_sessions)
+    )
+    return cur.rowcount
+
+
+def sweep(conn, schema: str, batch_size: int = SWEEP_BATCH, budget: float = None) -> dict:
+    '''Удаляет просроченные сессии пачками, пока они есть и не вышел бюджет (сек)'''
+    started = time.monotonic()
+    deleted = 0
+    batches = 0
+    cur = conn.cursor()
+    while True:
+        cur.execute(
+            f"DELETE FROM {schema}.sessions WHERE id IN ("
+            f"SELECT id FROM {schema}.sessions WHERE expires_at < NOW() "
+            f"LIMIT %s FOR UPDATE SKIP LOCKED)",
+            (batch_size,)
+        )
+        conn.commit()
+        batches += 1
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            break
+        if budget is not None and time.monotonic() - started >= budget:
+            break
+
+    cur.execute(
+        f"SELECT pg_total_relation_size('{schema}.sessions'), "
+        f"(SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = '{schema}.sessions'::regclass)"
+    )
+    size_bytes, approx_rows = cur.fetchone()
+    conn.rollback()
+    cur.close()
+
+    elapsed = time.monotonic() - started
+    return {
+        'deleted': deleted,
+        'batches': batches,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'rows_per_sec': round(deleted / elapsed) if elapsed > 0 else 0,
+        'table_bytes': size_bytes,
+        'table_rows_estimate': approx_rows
+    }
+
+
+def maybe_sweep(conn, schema: str):
+    '''Очистка по расписанию при прогреве; ошибка пишется в лог и не пробрасывается'''
+    global _next_sweep
+    now = time.monotonic()
+    if now < _next_sweep:
+        return None
+    _next_sweep = now + SWEEP_INTERVAL
+    try:
+        stats = sweep(conn, schema, budget=SWEEP_BUDGET)
+    except Exception as e:
+        # Транзакцию откатит db.put_conn при возврате соединения
+        print(json.dumps({'session_sweep': {'error': str(e)}}, ensure_ascii=False))
+        return None
+    print(json.dumps({'session_sweep': stats}))
+    return stats
+
+
+if __name__ == '__main__':
+    import db
+    conn = db.get_conn()
+    try:
+        print(json.dumps({'session_sweep': sweep(conn, os.environ['MAIN_DB_SCHEMA'])}))
+    finally:
+        db.put_conn(conn)
@@ -0,0 +1,191 @@
+'''Клиент Яндекс OAuth: обмен кода на токен и профиль пользователя.
+
+Соединения с oauth.yandex.ru и login.yandex.ru держатся открытыми между
+вызовами (keep-alive) и переиспользуются тёплым экземпляром. Каждая
+попытка ограничена OAUTH_TIMEOUT, весь обмен — OAUTH_DEADLINE секундами;
+сетевые ошибки и ответы 5xx запроса профиля повторяются с паузой, пока
+дедлайн позволяет. Обмен одноразового кода повторяется, только если
+запрос не успел уйти (ошибка подключения или закрытое keep-alive соединение).
+Профиль кэшируется по access_token на время жизни токена (не дольше
+OAUTH_INFO_CACHE_TTL), поэтому повторный вход с тем же токеном не ходит
+в Яндекс за профилем.
+'''
+import http.client
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
+
+import instrument
+from responses import loads
+
+YANDEX_OAUTH_URL = os.environ.get('YANDEX_OAUTH_URL', 'https://oauth.yandex.ru')
+YANDEX_LOGIN_URL = os.environ.get('YANDEX_LOGIN_URL', 'https://login.yandex.ru')
+
+TIMEOUT = float(os.environ.get('OAUTH_TIMEOUT', '3'))
+DEADLINE = float(os.environ.get('OAUTH_DEADLINE', '8'))
+RETRIES = int(os.environ.get('OAUTH_RETRIES', '2'))
+RETRY_BACKOFF = 0.1
+INFO_CACHE_TTL = float(os.environ.get('OAUTH_INFO_CACHE_TTL', '3600'))
+INFO_CACHE_SIZE = int(os.environ.get('OAUTH_INFO_CACHE_SIZE', '1000'))
+
+_idle = {}
+_idle_lock = threading.Lock()
+_info_cache = OrderedDict()
+_info_lock = threading.Lock()
+
+
+class OAuthError(Exception):
+    '''Ошибка обмена с Яндексом; status — код ответа или None, если ответа не было'''
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _origin(url: str) -> tuple:
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+def _take(origin: tuple, timeout: float):
+    with _idle_lock:
+        idle = _idle.get(origin)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        scheme, netloc = origin
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = cls(netloc, timeout=timeout)
+    else:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+    return conn
+
+
+def _give_back(origin: tuple, conn):
+    with _idle_lock:
+        _idle.setdefault(origin, []).append(conn)
+
+
+def _send(conn, method: str, path: str, body: bytes, headers: dict):
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def request(method: str, url: str, deadline: float, body: bytes = None, headers: dict = None,
+            idempotent: bool = True) -> dict:
+    '''JSON-ответ upstream; повторяет сетевые ошибки и 5xx до дедлайна (time.monotonic)
+
+    Неидемпотентный запрос (idempotent=False) повторяется, только если он
+    точно не ушёл: не удалось подключиться или сервер закрыл простаивавшее
+    keep-alive соединение. Таймаут чтения или 5xx после отправки — ошибка сразу.
+    '''
+    origin = _origin(url)
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    last_error = None
+    for attempt in range(RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        conn = _take(origin, min(TIMEOUT, remaining))
+        reused = conn.sock is not None
+        sent = False
+        try:
+            with instrument.span('upstream'):
+                if not reused:
+                    conn.connect()
+                try:
+                    sent = True
+                    response, raw = _send(conn, method, path, body, headers or {})
+                except (ConnectionError, http.client.RemoteDisconnected):
+                    if not reused:
+                        raise
+                    # Сервер закрыл простаивавшее keep-alive соединение — сразу новое
+                    conn.close()
+                    sent = False
+                    conn.connect()
+                    sent = True
+                    response, raw = _send(conn, method, path, body, headers or {})
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            last_error = OAuthError(f'{parts.netloc} недоступен: {e.__class__.__name__}')
+            if sent and not idempotent:
+                # Запрос мог дойти: повтор обмена кода получил бы invalid_grant
+                raise last_error
+        else:
+            if response.will_close:
+                conn.close()
+            else:
+                _give_back(origin, conn)
+            if response.status < 500:
+                try:
+                    data = loads(raw) if raw else {}
+                except ValueError:
+                    raise OAuthError(f'{parts.netloc}: некорректный ответ', response.status)
+                if response.status >= 400:
+                    raise OAuthError(data.get('error_description') or data.get('error') or 'ошибка', response.status)
+                return data
+            last_error = OAuthError(f'{parts.netloc} ответил {response.status}', response.status)
+            if not idempotent:
+                raise last_error
+        pause = RETRY_BACKOFF * 2 ** attempt
+        if time.monotonic() + pause >= deadline:
+            break
+        time.sleep(pause)
+    raise last_error or OAuthError(f'{parts.netloc}: дедлайн исчерпан')
+
+
+def exchange_code(code: str, deadline: float) -> dict:
+    '''{"access_token", "expires_in", ...} по коду подтверждения'''
+    body = urlencode({
+        'grant_type': 'authorization_code',
+        'code': code,
+        'client_id': os.environ.get('YANDEX_CLIENT_ID', ''),
+        'client_secret': os.environ.get('YANDEX_CLIENT_SECRET', '')
+    }).encode('utf-8')
+    # Код одноразовый: повтор после отправки вернул бы invalid_grant
+    return request('POST', f'{YANDEX_OAUTH_URL}/token', deadline, body,
+                   {'Content-Type': 'application/x-www-form-urlencoded'}, idempotent=False)
+
+
+def cached_info(access_token: str):
+    with _info_lock:
+        entry = _info_cache.get(access_token)
+        if entry is None:
+            return None
+        info, valid_until = entry
+        if valid_until <= time.monotonic():
+            del _info_cache[access_token]
+            return None
+        _info_cache.move_to_end(access_token)
+        return info
+
+
+def user_info(access_token: str, lifetime: float, deadline: float) -> dict:
+    '''Профиль Яндекса; кэшируется на lifetime секунд (не дольше INFO_CACHE_TTL)'''
+    info = cached_info(access_token)
+    if info is not None:
+        return info
+    info = request('GET', f'{YANDEX_LOGIN_URL}/info?format=json', deadline,
+                   headers={'Authorization': f'OAuth {access_token}'})
+    valid_until = time.monotonic() + min(lifetime, INFO_CACHE_TTL)
+    with _info_lock:
+        _info_cache[access_token] = (info, valid_until)
+        _info_cache.move_to_end(access_token)
+        while len(_info_cache) > INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def login(code: str) -> dict:
+    '''Профиль пользователя по коду подтверждения в пределах OAUTH_DEADLINE'''
+    deadline = time.monotonic() + DEADLINE
+    token = exchange_code(code, deadline)
+    access_token = token.get('access_token')
+    if not access_token:
+        raise OAuthError('Яндекс не выдал access_token')
+    return user_info(access_token, float(token.get('expires_in') or INFO_CACHE_TTL), deadline)
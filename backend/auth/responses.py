@@ -0,0 +1,206 @@
+'''Общий слой ответов: JSON, ETag с условным GET, сжатие и Cache-Control.
+
+ETag считается из версии данных (справочника, настроек) или из самого
+ответа. Если версия известна без БД, If-None-Match проверяется через
+not_modified() до запроса к базе. Тело больше COMPRESS_MIN_BYTES сжимается
+brotli или gzip, если клиент их принимает; у сжатого представления свой
+ETag с суффиксом кодировки ("...-br"), If-None-Match сравнивается без
+суффикса. JSON сериализуется orjson, если он установлен. orjson, сжатие и
+хэши импортируются при первом использовании: холодный старт и OPTIONS их
+не ждут.
+
+Модуль одинаково лежит в каждой функции: функции деплоятся независимо.
+'''
+import json
+import os
+
+import instrument
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+NO_STORE = 'no-store'
+PRIVATE_REVALIDATE = 'private, no-cache'
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag'}
+JSON_HEADERS = dict(CORS_HEADERS, **{'Content-Type': 'application/json'})
+NDJSON_HEADERS = dict(CORS_HEADERS, **{'Content-Type': 'application/x-ndjson'})
+
+_optional = {}
+
+
+def _optional_module(name: str):
+    '''Необязательная зависимость, импортированная один раз; None, если не установлена'''
+    if name not in _optional:
+        try:
+            _optional[name] = __import__(name)
+        except ImportError:
+            _optional[name] = None
+    return _optional[name]
+
+
+def dumps(data) -> str:
+    orjson = _optional_module('orjson')
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode('utf-8')
+        except TypeError:
+            # Decimal и прочее, чего orjson не знает
+            pass
+    return json.dumps(data, default=str)
+
+
+def loads(raw):
+    orjson = _optional_module('orjson')
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def header(event: dict, name: str) -> str:
+    '''Заголовок запроса без учёта регистра имени'''
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def make_etag(*parts) -> str:
+    import hashlib
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    return '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+ENCODING_SUFFIXES = ('-br"', '-gzip"')
+
+
+def _tagged(etag: str, encoding) -> str:
+    '''ETag представления: у сжатого тела свой тег, чтобы кэши не смешивали кодировки'''
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def _matching_tag(event: dict, etag: str):
+    '''Тег из If-None-Match, совпавший с etag в любой кодировке, иначе None'''
+    value = header(event, 'If-None-Match')
+    if not value or not etag:
+        return None
+    if value.strip() == '*':
+        return etag
+    for tag in value.split(','):
+        tag = tag.strip()
+        base = tag.removeprefix('W/')
+        for suffix in ENCODING_SUFFIXES:
+            if base.endswith(suffix):
+                base = base[:-len(suffix)] + '"'
+                break
+        if base == etag:
+            return tag
+    return None
+
+
+def etag_matches(event: dict, etag: str) -> bool:
+    return _matching_tag(event, etag) is not None
+
+
+def not_modified(event: dict, etag: str, cache_control: str = None):
+    '''Ответ 304, если у клиента уже есть эта версия, иначе None'''
+    tag = _matching_tag(event, etag)
+    if tag is None:
+        return None
+    # Отвечаем тем тегом, что прислал клиент: он указывает на его представление
+    headers = dict(CORS_HEADERS, ETag=tag)
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+
+def _encoding(event: dict):
+    accepted = set()
+    for part in header(event, 'Accept-Encoding').split(','):
+        name, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    if 'br' in accepted and _optional_module('brotli') is not None:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def json_response(data, event: dict = None, status: int = 200, cache_control: str = None,
+                  etag: str = None, headers: dict = None) -> dict:
+    '''JSON-ответ; при переданном event — с 304 по ETag и сжатием тела'''
+    event = event or {}
+    if status == 200 and etag:
+        cached = not_modified(event, etag, cache_control)
+        if cached is not None:
+            return cached
+
+    with instrument.span('serialize'):
+        body = dumps(data)
+    return _body_response(body, JSON_HEADERS, event, status, cache_control, etag, headers)
+
+
+def ndjson_response(items, event: dict = None, cache_control: str = None, etag: str = None) -> dict:
+    '''NDJSON: по объекту на строку; клиент разбирает строки по мере получения тела'''
+    event = event or {}
+    cached = not_modified(event, etag, cache_control)
+    if cached is not None:
+        return cached
+
+    with instrument.span('serialize'):
+        body = ''.join(dumps(item) + '\n' for item in items)
+    return _body_response(body, NDJSON_HEADERS, event, 200, cache_control, etag)
+
+
+def _body_response(body: str, base_headers: dict, event: dict, status: int, cache_control: str,
+                   etag: str, headers: dict = None) -> dict:
+    result_headers = dict(base_headers)
+    if cache_control:
+        result_headers['Cache-Control'] = cache_control
+    compressible = len(body) >= COMPRESS_MIN_BYTES
+    encoding = _encoding(event) if compressible else None
+    if etag:
+        result_headers['ETag'] = _tagged(etag, encoding)
+    if headers:
+        result_headers.update(headers)
+
+    if not compressible:
+        return {'statusCode': status, 'headers': result_headers, 'body': body, 'isBase64Encoded': False}
+
+    result_headers['Vary'] = 'Accept-Encoding'
+    if encoding is None:
+        return {'statusCode': status, 'headers': result_headers, 'body': body, 'isBase64Encoded': False}
+
+    import base64
+    with instrument.span('compress'):
+        raw = body.encode('utf-8')
+        if encoding == 'br':
+            packed = _optional_module('brotli').compress(raw, quality=BROTLI_QUALITY)
+        else:
+            import gzip
+            packed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+        encoded = base64.b64encode(packed).decode('ascii')
+    result_headers['Content-Encoding'] = encoding
+    return {
+        'statusCode': status,
+        'headers': result_headers,
+        'body': encoded,
+        'isBase64Encoded': True
+    }
+
+
+def error_response(status: int, message: str) -> dict:
+    # Короткое тело: обычный json, чтобы ошибка не ждала импорта orjson
+    headers = dict(JSON_HEADERS, **{'Cache-Control': NO_STORE})
+    return {'statusCode': status, 'headers': headers, 'body': json.dumps({'error': message}), 'isBase64Encoded': False}
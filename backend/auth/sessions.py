@@ -0,0 +1,70 @@
+'''Проверка сессионных токенов с LRU-кэшем в памяти процесса.
+
+Подтверждённый токен кэшируется до истечения сессии, но не дольше
+SESSION_CACHE_TTL секунд: так отзыв сессии на другом экземпляре доходит
+до этого не позже, чем через TTL. Локальный отзыв — revoke().
+
+Модуль одинаково лежит в каждой функции с сессиями: функции деплоятся независимо.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_token(event: dict) -> str:
+    return (event.get('headers') or {}).get('X-Authorization', '').replace('Bearer ', '')
+
+
+def cached_user(token: str):
+    '''user_id из кэша без обращения к БД или None'''
+    with _lock:
+        entry = _cache.get(token)
+        if entry is None:
+            return None
+        user_id, valid_until = entry
+        if valid_until <= time.time():
+            del _cache[token]
+            return None
+        _cache.move_to_end(token)
+        return user_id
+
+
+def remember(token: str, user_id: int, lifetime: float):
+    '''Кладёт подтверждённый токен в кэш; lifetime — секунды до конца сессии'''
+    valid_until = time.time() + min(lifetime, CACHE_TTL)
+    with _lock:
+        _cache[token] = (user_id, valid_until)
+        _cache.move_to_end(token)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def revoke(token: str):
+    with _lock:
+        _cache.pop(token, None)
+
+
+def resolve_user(cur, schema: str, token: str):
+    '''user_id владельца действующей сессии или None; в БД идём только при промахе'''
+    if not token:
+        return None
+    user_id = cached_user(token)
+    if user_id is not None:
+        return user_id
+    cur.execute(
+        f"SELECT user_id, EXTRACT(EPOCH FROM expires_at - NOW()) "
+        f"FROM {schema}.sessions WHERE token = %s AND expires_at > NOW()",
+        (token,)
+    )
+    result = cur.fetchone()
+    if not result:
+        return None
+    remember(token, result[0], float(result[1]))
+    return result[0]
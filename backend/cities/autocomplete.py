@@ -0,0 +1,214 @@
+'''Индекс автодополнения городов в памяти процесса.
+
+Строится один раз на тёплый контейнер из таблиц cities/countries и
+перестраивается, только когда меняется catalog_version. Поиск по началу
+слова идёт бинарным поиском по отсортированному массиву ключей, по подстроке —
+через str.find по склеенной строке ключей, без обращения к БД.
+
+Строки хранятся в порядке справочника (столицы, затем по названию и id),
+поэтому листание справочника и городов страны по курсору — срез после
+бинарного поиска, а ранжирование сравнивает номера строк вместо названий. Если есть снимок той же версии — рядом с функцией или
+опубликованный в БД (snapshot.py), — индекс не строится вовсе: файл
+отображается в память.
+'''
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from search import decode_cursor, encode_cursor
+
+CHECK_INTERVAL = float(os.environ.get('CITY_INDEX_CHECK_INTERVAL', '60'))
+# Короче этого ищем только по началу слова, как и в search.py
+MIN_SUBSTRING_LEN = 3
+
+TIER_NAME_PREFIX = 3
+TIER_OTHER = 2
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+_WORD_SPLIT = re.compile(r'[\s\-]+')
+
+
+def normalize(value: str) -> str:
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+
+def transliterate(value: str) -> str:
+    return ''.join(TRANSLIT.get(ch, ch) for ch in value)
+
+
+def rank_key(row) -> tuple:
+    '''Порядок справочника: столицы первыми, затем по названию и id'''
+    return not row[3], row[1], row[0]
+
+
+class CityIndex:
+    '''Неизменяемый снимок справочника с ключами для префиксного и подстрочного поиска'''
+
+    def __init__(self, rows: list, version):
+        rows = sorted(rows, key=rank_key)
+        self.rows = rows
+        self.version = version
+        self.by_id = {row[0]: row for row in rows}
+        self.capitals = sum(1 for row in rows if row[3])
+        # Название страны → номера её городов в порядке справочника
+        self.countries = {}
+
+        entries = []
+        segments = []
+        by_country = {}
+        for i, row in enumerate(rows):
+            name = normalize(row[1])
+            self.countries.setdefault(row[4], []).append(i)
+            by_country.setdefault(normalize(row[4]), []).append(i)
+            for full in {name, transliterate(name)}:
+                entries.append((full, TIER_NAME_PREFIX, (i,)))
+                segments.append((full, (i,)))
+                for word in _WORD_SPLIT.split(full)[1:]:
+                    entries.append((word, TIER_OTHER, (i,)))
+        for country, members in by_country.items():
+            members = tuple(members)
+            for full in {country, transliterate(country)}:
+                entries.append((full, TIER_OTHER, members))
+                segments.append((full, members))
+                for word in _WORD_SPLIT.split(full)[1:]:
+                    entries.append((word, TIER_OTHER, members))
+
+        entries.sort(key=lambda e: e[0])
+        self._keys = [e[0] for e in entries]
+        self._refs = [(e[1], e[2]) for e in entries]
+
+        self._blob = '\x00'.join(s[0] for s in segments)
+        self._offsets = []
+        self._members = []
+        offset = 0
+        for key, members in segments:
+            self._offsets.append(offset)
+            self._members.append(members)
+            offset += len(key) + 1
+
+    def listing(self, country: str, limit: int, cursor: str = '') -> tuple:
+        '''Страница справочника (или городов страны) по ключу (столица, название, id):
+        (строки, курсор следующей страницы или None)'''
+        positions = self.countries.get(country, ()) if country else range(len(self.rows))
+        start = 0
+        if cursor:
+            capital, name, city_id = decode_cursor(cursor)
+            after = bisect_right(self.rows, (not capital, name, city_id), key=rank_key)
+            start = bisect_left(positions, after)
+        page = [self.rows[i] for i in positions[start:start + limit]]
+        next_cursor = None
+        if page and start + limit < len(positions):
+            last = page[-1]
+            next_cursor = encode_cursor(int(bool(last[3])), last[1], last[0])
+        return page, next_cursor
+
+    def timezone_names(self) -> set:
+        return {row[2] for row in self.rows}
+
+    def _prefix_hits(self, q: str, best: dict):
+        i = bisect_left(self._keys, q)
+        end = bisect_right(self._keys, q + '\uffff', lo=i)
+        for tier, members in self._refs[i:end]:
+            for idx in members:
+                if best.get(idx, 0) < tier:
+                    best[idx] = tier
+
+    def _substring_hits(self, q: str, best: dict):
+        pos = self._blob.find(q)
+        while pos != -1:
+            segment = bisect_right(self._offsets, pos) - 1
+            for idx in self._members[segment]:
+                best.setdefault(idx, TIER_OTHER)
+            pos = self._blob.find(q, pos + 1)
+
+    def _ranked(self, best: dict, after) -> list:
+        '''[(-ранг, номер строки)] по убыванию ранга; внутри ранга номер строки
+        и есть порядок (название, id), потому что столичность входит в ранг'''
+        capitals = self.capitals
+        ranked = [(-(tier * 2 + (idx < capitals)), idx) for idx, tier in best.items()]
+        if after is not None:
+            score, name, city_id = after
+            # Первая строка после курсора в порядке справочника; курсор мог пережить смену версии
+            start = bisect_right(self.rows, (not score % 2, name, city_id), key=rank_key)
+            ranked = [item for item in ranked if -item[0] < score or (-item[0] == score and item[1] >= start)]
+        ranked.sort()
+        return ranked
+
+    def search(self, query: str, limit: int, cursor: str = '') -> tuple:
+        '''Тот же контракт, что у search.search_cities: (строки, курсор или None)'''
+        q = normalize(query)
+        after = decode_cursor(cursor) if cursor else None
+        best = {}
+        self._prefix_hits(q, best)
+        ranked = self._ranked(best, after)
+        # Подстроки попадают в TIER_OTHER наравне со словами и странами; пропустить их
+        # можно, только если страница и следующая за ней строка — совпадения по началу названия
+        page_full = len(ranked) > limit and -ranked[limit][0] >= TIER_NAME_PREFIX * 2
+        if not page_full and len(q) >= MIN_SUBSTRING_LEN:
+            self._substring_hits(q, best)
+            ranked = self._ranked(best, after)
+
+        page = [(-neg, self.rows[idx]) for neg, idx in ranked[:limit]]
+        next_cursor = None
+        if len(ranked) > limit:
+            score, row = page[-1]
+            next_cursor = encode_cursor(score, row[1], row[0])
+        return [row for _, row in page], next_cursor
+
+
+_index = None
+_next_check = 0.0
+_lock = threading.Lock()
+
+# Снимок, приложенный к функции при деплое; без него снимок скачивается из БД (snapshot.py)
+SNAPSHOT_PATH = os.environ.get(
+    'CITY_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.snapshot')
+)
+
+
+def _load(cur, schema: str, version) -> CityIndex:
+    cur.execute(
+        f"SELECT c.id, c.name, c.timezone, c.is_capital, co.name as country, c.latitude, c.longitude "
+        f"FROM {schema}.cities c "
+        f"JOIN {schema}.countries co ON c.country_id = co.id"
+    )
+    return CityIndex(cur.fetchall(), version)
+
+
+def get_index(schema: str) -> CityIndex:
+    '''Текущий индекс; версия в БД сверяется не чаще раза в CHECK_INTERVAL секунд'''
+    global _index, _next_check
+    if _index is not None and time.monotonic() < _next_check:
+        return _index
+    with _lock:
+        if _index is not None and time.monotonic() < _next_check:
+            return _index
+        import db
+        # Справочник меняется редко, а версия сверяется с БД: реплики хватает
+        conn = db.get_read_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT version FROM {schema}.catalog_version WHERE id = 1")
+            row = cur.fetchone()
+            version = row[0] if row else None
+            if _index is None or version is None or version != _index.version:
+                from snapshot import load_snapshot
+                # Прежний снимок не закрываем: его ещё могут читать запросы, взявшие
+                # индекс до смены версии; отображение снимется с последней ссылкой
+                _index = load_snapshot(cur, schema, version, SNAPSHOT_PATH) or _load(cur, schema, version)
+            cur.close()
+            conn.rollback()
+        finally:
+            db.put_conn(conn)
+        _next_check = time.monotonic() + CHECK_INTERVAL
+    return _index
@@ -0,0 +1,307 @@
+'''Массовая загрузка справочника городов и стран через COPY.
+
+Запуск (DATABASE_URL и MAIN_DB_SCHEMA как у функции):
+    python catalog_import.py cities.tsv [--countries countries.csv] [--format geonames]
+        [--prune] [--indexes auto|rebuild|keep] [--dry-run] [--no-snapshot]
+
+Файл городов читается потоково пачками по --chunk строк. Формат csv/tsv —
+с заголовком source_id, name, country_code, timezone, latitude, longitude
+и необязательными is_capital и aliases (альтернативные названия через
+запятую); формат geonames — выгрузка cities*.txt (geonameid,
+alternatenames, широта/долгота, код страны, часовой пояс, PPLC — столица).
+Часовые пояса проверяются по zoneinfo, коды стран разрешаются в памяти по
+countries.code и необязательной колонке alias файла стран (например, ISO2
+для выгрузки GeoNames). Отвергнутые строки считаются и не загружаются.
+
+Строки идут через COPY во временную таблицу, затем одной транзакцией
+сливаются в cities по source_id: новые добавляются, изменившиеся
+обновляются, с --prune удаляются импортированные ранее города, которых
+нет в файле (кроме тех, что у кого-то в избранном). Города без source_id
+(начальные из миграций) перед слиянием получают source_id строки файла той
+же страны с тем же названием или альтернативным названием GeoNames — при
+нескольких кандидатах ближайшей по координатам, — поэтому обновляются, а
+не дублируются. id городов стабильны, поэтому избранное пользователей не
+ломается, а читатели видят старый или новый справочник целиком.
+Повторный запуск с тем же файлом ничего не меняет и не сдвигает
+catalog_version. При большой загрузке (--indexes auto: новых строк больше,
+чем уже есть) вторичные индексы cities удаляются до слияния и строятся
+один раз в конце той же транзакции.
+После изменений снимок справочника для функций пересобирается и
+публикуется в БД (snapshot.py), если не указан --no-snapshot.
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from zoneinfo import available_timezones
+
+CHUNK_ROWS = 20000
+NAME_MAX = 100
+REJECT_SAMPLES = 20
+
+COLUMNS = ('source_id', 'name', 'country_id', 'timezone', 'is_capital', 'latitude', 'longitude', 'aliases')
+GEONAMES = {'source_id': 0, 'name': 1, 'aliases': 3, 'latitude': 4, 'longitude': 5, 'feature': 7, 'country_code': 8, 'timezone': 17}
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+
+
+class Rejects:
+    def __init__(self):
+        self.count = 0
+        self.samples = []
+
+    def add(self, line: int, reason: str):
+        self.count += 1
+        if len(self.samples) < REJECT_SAMPLES:
+            self.samples.append(f'{line}: {reason}')
+
+
+def read_rows(path: str, fmt: str):
+    '''(номер строки, dict полей) из файла; для csv/tsv — по заголовку'''
+    delimiter = ',' if fmt == 'csv' else '\t'
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'geonames':
+            for line, row in enumerate(csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE), 1):
+                if len(row) <= GEONAMES['timezone']:
+                    yield line, None
+                    continue
+                fields = {key: row[i] for key, i in GEONAMES.items()}
+                fields['is_capital'] = fields.pop('feature') == 'PPLC'
+                yield line, fields
+        else:
+            for line, row in enumerate(csv.DictReader(f, delimiter=delimiter), 2):
+                yield line, row
+
+
+def parse_row(fields: dict, countries: dict, zones: set):
+    '''Кортеж для COPY в порядке COLUMNS или строка с причиной отказа'''
+    if not fields:
+        return 'не хватает колонок'
+    try:
+        source_id = int(fields['source_id'])
+    except (KeyError, TypeError, ValueError):
+        return 'source_id не число'
+    name = (fields.get('name') or '').strip()
+    if not name or len(name) > NAME_MAX:
+        return f'название пустое или длиннее {NAME_MAX}'
+    country_id = countries.get((fields.get('country_code') or '').strip().upper())
+    if country_id is None:
+        return f"неизвестная страна {fields.get('country_code')!r}"
+    timezone = (fields.get('timezone') or '').strip()
+    if timezone not in zones:
+        return f'неизвестный часовой пояс {timezone!r}'
+    try:
+        latitude = round(float(fields['latitude']), 6)
+        longitude = round(float(fields['longitude']), 6)
+    except (KeyError, TypeError, ValueError):
+        return 'координаты не числа'
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return 'координаты вне диапазона'
+    capital = fields.get('is_capital')
+    is_capital = capital if isinstance(capital, bool) else str(capital or '').strip().lower() in TRUE_VALUES
+    # Альтернативные названия нужны только для сопоставления с городами без source_id
+    aliases = ','.join(sorted({a.strip().lower() for a in (fields.get('aliases') or '').split(',') if a.strip()}))
+    return source_id, name, country_id, timezone, is_capital, latitude, longitude, aliases
+
+
+def copy_rows(cur, table: str, columns: tuple, rows: list):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def import_countries(cur, schema: str, path: str) -> int:
+    '''Добавляет и переименовывает страны из файла code,name[,alias]; возвращает число изменённых'''
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = [(r['code'].strip().upper(), r['name'].strip(), (r.get('alias') or '').strip().upper())
+                for r in csv.DictReader(f) if r.get('code') and r.get('name')]
+    cur.execute("CREATE TEMP TABLE country_import (code VARCHAR(3), name VARCHAR(100), alias VARCHAR(3)) ON COMMIT DROP")
+    copy_rows(cur, 'country_import', ('code', 'name', 'alias'), rows)
+    cur.execute(
+        f"INSERT INTO {schema}.countries (code, name) SELECT DISTINCT ON (code) code, name FROM country_import "
+        f"ON CONFLICT (code) DO UPDATE SET name = EXCLUDED.name WHERE countries.name IS DISTINCT FROM EXCLUDED.name"
+    )
+    return cur.rowcount
+
+
+def country_map(cur, schema: str, with_aliases: bool) -> dict:
+    '''Код страны (и alias из файла стран) → id'''
+    cur.execute(f"SELECT code, id FROM {schema}.countries")
+    countries = {code.upper(): country_id for code, country_id in cur.fetchall()}
+    if with_aliases:
+        cur.execute(
+            f"SELECT i.alias, c.id FROM country_import i JOIN {schema}.countries c ON c.code = i.code "
+            f"WHERE i.alias <> ''"
+        )
+        for alias, country_id in cur.fetchall():
+            countries.setdefault(alias, country_id)
+    return countries
+
+
+def secondary_indexes(cur, schema: str) -> list:
+    '''Индексы cities, не обслуживающие ограничения: их можно пересобрать'''
+    cur.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = %s AND tablename = 'cities' "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        (schema, f'{schema}.cities')
+    )
+    return cur.fetchall()
+
+
+def match_unsourced(cur, schema: str) -> int:
+    '''Проставляет source_id городам без него (начальным из миграций) по стране и
+    названию; каждая строка файла достаётся не более чем одному городу'''
+    cur.execute(
+        f"UPDATE {schema}.cities c SET source_id = m.source_id FROM ("
+        f"  SELECT DISTINCT ON (source_id) source_id, city_id FROM ("
+        f"    SELECT DISTINCT ON (c.id) c.id AS city_id, i.source_id "
+        f"    FROM {schema}.cities c JOIN city_import i ON i.country_id = c.country_id "
+        f"      AND (lower(i.name) = lower(c.name) OR lower(c.name) = ANY (string_to_array(i.aliases, ','))) "
+        f"    WHERE c.source_id IS NULL "
+        f"      AND NOT EXISTS (SELECT 1 FROM {schema}.cities o WHERE o.source_id = i.source_id) "
+        f"    ORDER BY c.id, (i.is_capital = c.is_capital) DESC, "
+        f"      (i.latitude - c.latitude) ^ 2 + (i.longitude - c.longitude) ^ 2 NULLS LAST, i.source_id"
+        f"  ) candidates ORDER BY source_id, city_id"
+        f") m WHERE c.id = m.city_id"
+    )
+    return cur.rowcount
+
+
+def run(conn, schema: str, path: str, fmt: str = 'tsv', countries_path: str = None, prune: bool = False,
+        indexes: str = 'auto', chunk: int = CHUNK_ROWS, dry_run: bool = False) -> dict:
+    started = time.monotonic()
+    zones = available_timezones()
+    rejects = Rejects()
+    seen = set()
+    cur = conn.cursor()
+    stats = {'countries_changed': 0}
+
+    if countries_path:
+        stats['countries_changed'] = import_countries(cur, schema, countries_path)
+    countries = country_map(cur, schema, bool(countries_path))
+
+    cur.execute(
+        "CREATE TEMP TABLE city_import (source_id BIGINT, name VARCHAR(100), country_id INTEGER, "
+        "timezone VARCHAR(100), is_capital BOOLEAN, latitude DECIMAL(9,6), longitude DECIMAL(9,6), "
+        "aliases TEXT) ON COMMIT DROP"
+    )
+    batch = []
+    for line, fields in read_rows(path, fmt):
+        row = parse_row(fields, countries, zones)
+        if isinstance(row, str):
+            rejects.add(line, row)
+            continue
+        if row[0] in seen:
+            rejects.add(line, f'повтор source_id {row[0]}')
+            continue
+        seen.add(row[0])
+        batch.append(row)
+        if len(batch) >= chunk:
+            copy_rows(cur, 'city_import', COLUMNS, batch)
+            batch = []
+    if batch:
+        copy_rows(cur, 'city_import', COLUMNS, batch)
+    stats['loaded'] = len(seen)
+    stats['rejected'] = rejects.count
+    stats['reject_samples'] = rejects.samples
+    stats['read_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+    cur.execute("ALTER TABLE city_import ADD PRIMARY KEY (source_id)")
+    cur.execute("ANALYZE city_import")
+    stats['matched'] = match_unsourced(cur, schema)
+    changed = (
+        "(c.country_id, c.name, c.timezone, c.is_capital, c.latitude, c.longitude) IS DISTINCT FROM "
+        "(i.country_id, i.name, i.timezone, i.is_capital, i.latitude, i.longitude)"
+    )
+    stale = (
+        f"c.source_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM city_import i WHERE i.source_id = c.source_id) "
+        f"AND NOT EXISTS (SELECT 1 FROM {schema}.user_favorites f WHERE f.city_id = c.id)"
+    )
+    cur.execute(
+        f"SELECT (SELECT COUNT(*) FROM {schema}.cities), "
+        f"(SELECT COUNT(*) FROM city_import i WHERE NOT EXISTS "
+        f"  (SELECT 1 FROM {schema}.cities c WHERE c.source_id = i.source_id)), "
+        f"(SELECT COUNT(*) FROM city_import i JOIN {schema}.cities c ON c.source_id = i.source_id WHERE {changed}), "
+        f"(SELECT COUNT(*) FROM {schema}.cities c WHERE {stale})"
+    )
+    existing, inserted, updated, removable = cur.fetchone()
+    stats.update(inserted=inserted, updated=updated, stale=removable, deleted=removable if prune else 0)
+
+    has_changes = inserted or updated or stats['matched'] or (prune and removable) or stats['countries_changed']
+    if dry_run or not has_changes:
+        conn.rollback()
+        cur.close()
+        stats['committed'] = False
+        stats['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return stats
+
+    rebuild = indexes == 'rebuild' or (indexes == 'auto' and inserted > existing)
+    dropped = secondary_indexes(cur, schema) if rebuild else []
+    for name, _ in dropped:
+        cur.execute(f"DROP INDEX {schema}.{name}")
+
+    if prune and removable:
+        cur.execute(f"DELETE FROM {schema}.cities c WHERE {stale}")
+    if inserted or updated:
+        cur.execute(
+            f"INSERT INTO {schema}.cities (source_id, country_id, name, timezone, is_capital, latitude, longitude) "
+            f"SELECT source_id, country_id, name, timezone, is_capital, latitude, longitude FROM city_import "
+            f"ON CONFLICT (source_id) DO UPDATE SET country_id = EXCLUDED.country_id, name = EXCLUDED.name, "
+            f"timezone = EXCLUDED.timezone, is_capital = EXCLUDED.is_capital, "
+            f"latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude "
+            f"WHERE (cities.country_id, cities.name, cities.timezone, cities.is_capital, cities.latitude, cities.longitude) "
+            f"IS DISTINCT FROM (EXCLUDED.country_id, EXCLUDED.name, EXCLUDED.timezone, EXCLUDED.is_capital, "
+            f"EXCLUDED.latitude, EXCLUDED.longitude)"
+        )
+
+    if dropped:
+        index_started = time.monotonic()
+        cur.execute("SET LOCAL maintenance_work_mem = '256MB'")
+        for _, definition in dropped:
+            cur.execute(definition)
+        stats['indexes_rebuilt'] = [name for name, _ in dropped]
+        stats['index_ms'] = round((time.monotonic() - index_started) * 1000, 1)
+
+    conn.commit()
+    cur.execute(f"ANALYZE {schema}.cities")
+    conn.commit()
+    cur.close()
+    stats['committed'] = True
+    stats['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('tsv', 'csv', 'geonames'), default=None,
+                        help='по умолчанию — по расширению файла')
+    parser.add_argument('--countries', help='csv code,name[,alias]')
+    parser.add_argument('--prune', action='store_true', help='удалить импортированные города, которых нет в файле')
+    parser.add_argument('--indexes', choices=('auto', 'rebuild', 'keep'), default='auto')
+    parser.add_argument('--chunk', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--no-snapshot', action='store_true', help='не пересобирать снимок справочника (snapshot.py)')
+    args = parser.parse_args()
+    fmt = args.format or ('csv' if args.path.endswith('.csv') else 'tsv')
+
+    import db
+    conn = db.get_conn()
+    try:
+        stats = run(conn, os.environ['MAIN_DB_SCHEMA'], args.path, fmt, args.countries, args.prune,
+                    args.indexes, args.chunk, args.dry_run)
+        if stats.get('committed') and not args.no_snapshot:
+            from snapshot import build
+            stats['snapshot'] = build(conn, os.environ['MAIN_DB_SCHEMA'])
+    finally:
+        db.put_conn(conn)
+    print(json.dumps({'catalog_import': stats}, ensure_ascii=False))
+    if stats['rejected'] and not stats['loaded']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''Пакетный перевод моментов времени в местное время многих городов.
+
+Матрица «моменты × пояса» считается за один проход: для каждого
+уникального пояса np.searchsorted по массиву переходов из timezones.py
+сразу для всех моментов.
+'''
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from timezones import DAY, get_table
+
+MAX_TIMESTAMPS = int(os.environ.get('CONVERT_MAX_TIMESTAMPS', '10000'))
+MAX_TARGETS = int(os.environ.get('CONVERT_MAX_TARGETS', '500'))
+MAX_SPAN_DAYS = int(os.environ.get('CONVERT_MAX_SPAN_DAYS', '3660'))
+# Строки местного времени дороги в JSON: отдаём их только для небольших матриц
+MAX_LOCAL_CELLS = int(os.environ.get('CONVERT_MAX_LOCAL_CELLS', '100000'))
+# Допустимые моменты: 1900-01-01 — 2100-01-01 UTC
+MIN_TIMESTAMP = -2208988800
+MAX_TIMESTAMP = 4102444800
+
+class ConvertError(ValueError):
+    pass
+
+
+def parse_timestamp(value) -> int:
+    '''Секунды UTC из числа (секунды или миллисекунды) или строки ISO 8601'''
+    if isinstance(value, bool):
+        raise ConvertError(f'Некорректное время: {value}')
+    if isinstance(value, (int, float)):
+        # Сравнение int с float точное: огромные числа, бесконечность и NaN отсекаются до деления
+        if not abs(value) < MAX_TIMESTAMP * 1000:
+            raise ConvertError('Время вне диапазона 1900–2100 годов')
+        seconds = value / 1000 if abs(value) > 1e11 else value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            raise ConvertError(f'Некорректное время: {value}')
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        seconds = dt.timestamp()
+    if not MIN_TIMESTAMP <= seconds < MAX_TIMESTAMP:
+        raise ConvertError(f'Время вне диапазона 1900–2100 годов: {value}')
+    return int(seconds)
+
+
+def parse_timestamps(body: dict) -> np.ndarray:
+    '''Моменты из timestamps: [...] или диапазона range: {start, end, step}'''
+    if body.get('range'):
+        rng = body['range']
+        try:
+            start = parse_timestamp(rng['start'])
+            end = parse_timestamp(rng['end'])
+            step = int(rng.get('step', 3600))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ConvertError('range требует start, end и step')
+        if step <= 0 or end < start:
+            raise ConvertError('Некорректный диапазон')
+        if (end - start) // step + 1 > MAX_TIMESTAMPS:
+            raise ConvertError(f'Не больше {MAX_TIMESTAMPS} моментов за запрос')
+        return np.arange(start, end + 1, step, dtype=np.int64)
+
+    values = body.get('timestamps')
+    if values is None:
+        values = [body['timestamp']] if 'timestamp' in body else []
+    if not values:
+        raise ConvertError('Не указаны моменты времени')
+    if not isinstance(values, list):
+        raise ConvertError('timestamps должен быть списком')
+    if len(values) > MAX_TIMESTAMPS:
+        raise ConvertError(f'Не больше {MAX_TIMESTAMPS} моментов за запрос')
+    return np.array([parse_timestamp(v) for v in values], dtype=np.int64)
+
+
+def _zone_arrays(tz_name: str, start: int, end: int) -> tuple:
+    table = get_table(tz_name, start, end)
+    if table is None:
+        raise ConvertError(f'Неизвестный часовой пояс: {tz_name}')
+    if table.arrays is None:
+        table.arrays = (
+            np.array(table.starts, dtype=np.int64),
+            np.array([info[0] for info in table.infos], dtype=np.int32)
+        )
+    return table.arrays
+
+
+def offsets_matrix(ts: np.ndarray, zones: list) -> np.ndarray:
+    '''Смещения от UTC, секунды; форма (len(zones), len(ts))'''
+    start, end = int(ts.min()), int(ts.max())
+    if end - start > MAX_SPAN_DAYS * DAY:
+        raise ConvertError(f'Диапазон не длиннее {MAX_SPAN_DAYS} дней')
+    out = np.empty((len(zones), len(ts)), dtype=np.int32)
+    for j, tz_name in enumerate(zones):
+        starts, offsets = _zone_arrays(tz_name, start, end)
+        out[j] = offsets[np.searchsorted(starts, ts, side='right') - 1]
+    return out
+
+
+def convert(ts: np.ndarray, targets: list, from_tz: str = 'UTC', include_local: bool = False) -> dict:
+    '''targets: [{'timezone': ..., 'city_id'?: ..., 'name'?: ...}]
+
+    Для каждой цели возвращает смещения, сдвиг календарного дня
+    относительно from_tz (-1, 0, +1) и, по запросу, строки местного времени.
+    '''
+    if not targets:
+        raise ConvertError('Не указаны города или часовые пояса')
+    if len(targets) > MAX_TARGETS:
+        raise ConvertError(f'Не больше {MAX_TARGETS} городов за запрос')
+    if not isinstance(from_tz, str):
+        raise ConvertError(f'Неизвестный часовой пояс: {from_tz}')
+
+    zones = list(dict.fromkeys([from_tz] + [t['timezone'] for t in targets]))
+    column = {tz_name: j for j, tz_name in enumerate(zones)}
+    offsets = offsets_matrix(ts, zones)
+    local = ts[np.newaxis, :] + offsets
+    local_days = local // DAY
+    day_shift = local_days - local_days[column[from_tz]]
+
+    with_local = include_local and len(ts) * len(targets) <= MAX_LOCAL_CELLS
+    if with_local:
+        local_str = np.datetime_as_string(local.astype('datetime64[s]'), unit='s')
+
+    results = []
+    for target in targets:
+        j = column[target['timezone']]
+        result = dict(target)
+        result['offsets'] = offsets[j].tolist()
+        result['day_shift'] = day_shift[j].tolist()
+        if with_local:
+            result['local'] = local_str[j].tolist()
+        results.append(result)
+
+    return {
+        'timestamps': ts.tolist(),
+        'from_timezone': from_tz,
+        'results': results
+    }
@@ -0,0 +1,294 @@
+'''Пул соединений PostgreSQL, переживающий тёплые вызовы функции.
+
+Чтения, которым не нужна самая свежая запись, могут идти на реплики:
+DATABASE_REPLICA_URLS — одна или несколько DSN через запятую. get_read_conn()
+берёт соединение с исправной реплики по кругу; реплика, к которой не
+удалось подключиться или которая отстала больше чем на DB_REPLICA_MAX_LAG
+секунд, выводится из оборота на DB_REPLICA_RETRY_AFTER секунд. Если
+исправных реплик нет (или они не заданы), читаем с основной БД. Реплика,
+у которой просто заняты все соединения пула, исправна: её пропускаем, не
+выводя из оборота.
+
+Модуль одинаково лежит в каждой функции с БД: функции деплоятся независимо.
+'''
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import instrument
+
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+HEALTH_CHECK_IDLE = float(os.environ.get('DB_HEALTH_CHECK_IDLE', '30'))
+STATS_LOG_EVERY = int(os.environ.get('DB_POOL_LOG_EVERY', '0'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+REPLICA_RETRY_AFTER = float(os.environ.get('DB_REPLICA_RETRY_AFTER', '30'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+# Сколько ждать свободного соединения реплики, прежде чем перейти к следующей
+REPLICA_POOL_TIMEOUT = float(os.environ.get('DB_REPLICA_POOL_TIMEOUT', '0.1'))
+
+# Отставание реплики: 0, если всё принятое уже применено (или это не реплика)
+LAG_QUERY = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class PoolExhausted(psycopg2.OperationalError):
+    '''Все соединения пула заняты дольше timeout: база исправна, просто занята'''
+
+
+class Pool:
+    '''Ограниченный пул: свободные соединения переиспользуются, при исчерпании ждём.'''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX, timeout: float = POOL_TIMEOUT,
+                 check_idle: float = HEALTH_CHECK_IDLE, readonly: bool = False):
+        self.dsn = dsn
+        self.readonly = readonly
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.acquired = 0
+        self.hits = 0
+        self.reconnects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=instrument.cursor_factory())
+        if self.readonly:
+            conn.set_session(readonly=True)
+        return conn
+
+    def _healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def get(self):
+        started = time.monotonic()
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise PoolExhausted('Пул соединений исчерпан')
+                self._cond.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            waited = time.monotonic() - started
+            self.acquired += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        try:
+            if entry is not None:
+                conn, idle_since = entry
+                if self._healthy(conn, idle_since):
+                    self.hits += 1
+                    self._maybe_log()
+                    return conn
+                self._close_quietly(conn)
+                self.reconnects += 1
+            conn = self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+        self._maybe_log()
+        return conn
+
+    def put(self, conn, discard: bool = False):
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or conn.closed:
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._in_use -= 1
+            self._cond.notify()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': len(self._idle) + self._in_use,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+                'acquired': self.acquired,
+                'hit_rate': round(self.hits / self.acquired, 4) if self.acquired else 0.0,
+                'reconnects': self.reconnects,
+                'wait_ms_avg': round(self.wait_total * 1000 / self.acquired, 3) if self.acquired else 0.0,
+                'wait_ms_max': round(self.wait_max * 1000, 3)
+            }
+
+    def _maybe_log(self):
+        if STATS_LOG_EVERY and self.acquired % STATS_LOG_EVERY == 0:
+            print(json.dumps({'db_pool': self.stats()}))
+
+
+class Replica:
+    '''Пул соединений реплики и её здоровье'''
+
+    def __init__(self, dsn: str):
+        self.pool = Pool(dsn, timeout=REPLICA_POOL_TIMEOUT, readonly=True)
+        self.down_until = 0.0
+        self.next_check = 0.0
+        self.lag = None
+        self.failures = 0
+        self.last_error = None
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self, reason: str):
+        self.failures += 1
+        self.last_error = reason
+        self.down_until = time.monotonic() + REPLICA_RETRY_AFTER
+
+    def get(self):
+        '''Соединение или None, если реплика недоступна, отстала или её пул занят'''
+        try:
+            conn = self.pool.get()
+        except PoolExhausted:
+            # Занятая реплика исправна: из оборота не выводим, читаем с другой
+            return None
+        except psycopg2.Error as e:
+            self.mark_down(e.__class__.__name__)
+            return None
+        if time.monotonic() < self.next_check:
+            return conn
+        try:
+            cur = conn.cursor()
+            cur.execute(LAG_QUERY)
+            self.lag = float(cur.fetchone()[0])
+            cur.close()
+            conn.rollback()
+        except psycopg2.Error as e:
+            self.pool.put(conn, discard=True)
+            self.mark_down(e.__class__.__name__)
+            return None
+        self.next_check = time.monotonic() + REPLICA_CHECK_INTERVAL
+        if self.lag > REPLICA_MAX_LAG:
+            self.pool.put(conn)
+            self.mark_down(f'lag {self.lag:.1f}s')
+            return None
+        return conn
+
+    def stats(self) -> dict:
+        return dict(
+            self.pool.stats(),
+            available=self.available(),
+            lag=self.lag,
+            failures=self.failures,
+            last_error=self.last_error
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+_next_replica = None
+# id соединения с реплики → реплика, чтобы put_conn вернул его в свой пул
+_replica_conns = {}
+
+
+def pool() -> Pool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = Pool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def replicas() -> list:
+    global _replicas, _next_replica
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                urls = re.split(r'[\s,]+', os.environ.get('DATABASE_REPLICA_URLS', '').strip())
+                _next_replica = itertools.count()
+                _replicas = [Replica(url) for url in urls if url]
+    return _replicas
+
+
+def get_conn():
+    '''Берёт соединение из пула модуля (создаётся при первом вызове)'''
+    with instrument.span('connect'):
+        return pool().get()
+
+
+def get_read_conn():
+    '''Соединение для чтения: с исправной реплики по кругу, иначе с основной БД'''
+    candidates = replicas()
+    if candidates:
+        start = next(_next_replica)
+        with instrument.span('connect'):
+            for i in range(len(candidates)):
+                replica = candidates[(start + i) % len(candidates)]
+                if not replica.available():
+                    continue
+                conn = replica.get()
+                if conn is not None:
+                    _replica_conns[id(conn)] = replica
+                    return conn
+    return get_conn()
+
+
+def is_replica(conn) -> bool:
+    return id(conn) in _replica_conns
+
+
+def put_conn(conn, discard: bool = False):
+    '''Возвращает соединение в пул; незавершённая транзакция откатывается'''
+    replica = _replica_conns.pop(id(conn), None)
+    if replica is None:
+        pool().put(conn, discard)
+        return
+    if conn.closed:
+        # Соединение оборвалось посреди запроса — реплика, скорее всего, недоступна
+        replica.mark_down('connection closed')
+    replica.pool.put(conn, discard)
+
+
+def stats() -> dict:
+    result = pool().stats()
+    if replicas():
+        result['replicas'] = [replica.stats() for replica in replicas()]
+    return result
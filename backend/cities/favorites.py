@@ -0,0 +1,161 @@
+'''Избранные города и стартовые данные главной страницы.
+
+bootstrap() собирает профиль, настройки, избранное и кэш погоды одним
+запросом с JOIN: при открытии страницы фронтенд делает один вызов вместо
+отдельных запросов к auth, settings, cities и weather.
+
+Погода берётся из таблицы weather_cache, которую пишет только функция
+weather с WEATHER_CACHE_BACKEND=postgres. Переменная задаётся обеим
+функциям; при кэше в памяти (по умолчанию) таблица пуста, поэтому
+bootstrap её не читает и отдаёт weather: null — фронтенд тогда
+запрашивает погоду сам.
+'''
+import json
+import os
+
+MAX_FAVORITES = int(os.environ.get('FAVORITES_MAX', '200'))
+# TTL + окно stale кэша погоды: старше — пусть фронтенд сходит в weather сам
+WEATHER_MAX_AGE = float(os.environ.get('WEATHER_CACHE_MAX_AGE', '2400'))
+WEATHER_FROM_CACHE = os.environ.get('WEATHER_CACHE_BACKEND', 'memory') == 'postgres'
+DEFAULT_SETTINGS = {
+    'theme': 'white',
+    'weather_city': 'Москва',
+    'timezone_mode': '24',
+    'notifications_enabled': True
+}
+
+# Та же нормализация, что normalize_city() в weather/cache.py
+_CITY_KEY = "regexp_replace(btrim(replace(lower({}), 'ё', 'е')), '\\s+', ' ', 'g')"
+
+
+def _favorites_subquery(schema: str) -> str:
+    return (
+        f"SELECT COALESCE(json_agg(json_build_array("
+        f"c.id, c.name, c.timezone, c.is_capital, co.name, c.latitude, c.longitude"
+        f") ORDER BY f.position NULLS LAST, f.created_at, f.id), '[]') "
+        f"FROM {schema}.user_favorites f "
+        f"JOIN {schema}.cities c ON c.id = f.city_id "
+        f"JOIN {schema}.countries co ON co.id = c.country_id "
+        f"WHERE f.user_id = %s"
+    )
+
+
+def list_favorites(cur, schema: str, user_id: int) -> list:
+    cur.execute(_favorites_subquery(schema), (user_id,))
+    return cur.fetchone()[0]
+
+
+def parse_city_id(value) -> int:
+    '''id города из запроса; вне диапазона INTEGER — ошибка, а не DataError в БД'''
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('city_id — число')
+    try:
+        city_id = int(value)
+    except ValueError:
+        raise ValueError('city_id — число')
+    if not 0 < city_id < 2 ** 31:
+        raise ValueError('city_id — число')
+    return city_id
+
+
+def add_favorite(cur, schema: str, user_id: int, city_id: int):
+    '''Новый город встаёт в конец списка'''
+    city_id = parse_city_id(city_id)
+    cur.execute(
+        f"INSERT INTO {schema}.user_favorites (user_id, city_id, position) "
+        f"SELECT %s, %s, COALESCE(MAX(position), 0) + 1 "
+        f"FROM {schema}.user_favorites WHERE user_id = %s "
+        f"ON CONFLICT (user_id, city_id) DO NOTHING",
+        (user_id, city_id, user_id)
+    )
+
+
+def delete_favorite(cur, schema: str, user_id: int, city_id: int) -> bool:
+    city_id = parse_city_id(city_id)
+    cur.execute(
+        f"DELETE FROM {schema}.user_favorites WHERE user_id = %s AND city_id = %s",
+        (user_id, city_id)
+    )
+    return cur.rowcount > 0
+
+
+def reorder_favorites(cur, schema: str, user_id: int, city_ids: list):
+    '''Проставляет позиции по порядку city_ids одним UPDATE; прочие города уходят в конец'''
+    if not isinstance(city_ids, list) or len(city_ids) > MAX_FAVORITES:
+        raise ValueError(f'city_ids — список не длиннее {MAX_FAVORITES}')
+    try:
+        city_ids = [parse_city_id(city_id) for city_id in city_ids]
+    except ValueError:
+        raise ValueError('city_ids — список чисел')
+    # Неупомянутые города сохраняют свой взаимный порядок и встают после перечисленных
+    cur.execute(
+        f"WITH listed AS ("
+        f"SELECT id AS city_id, MIN(pos) AS pos FROM unnest(%s::int[]) WITH ORDINALITY AS u(id, pos) GROUP BY id"
+        f"), ordered AS ("
+        f"SELECT f.id, COALESCE(l.pos, %s + ROW_NUMBER() OVER ("
+        f"PARTITION BY l.pos IS NULL ORDER BY f.position NULLS LAST, f.created_at, f.id"
+        f")) AS position "
+        f"FROM {schema}.user_favorites f LEFT JOIN listed l ON l.city_id = f.city_id "
+        f"WHERE f.user_id = %s"
+        f") "
+        f"UPDATE {schema}.user_favorites f SET position = o.position "
+        f"FROM ordered o WHERE f.id = o.id",
+        (city_ids, len(city_ids), user_id)
+    )
+
+
+def bootstrap(cur, schema: str, user_id: int):
+    '''(профиль, настройки, строки избранных городов, погода или None); None — нет пользователя'''
+    weather, weather_join = "NULL, NULL", ""
+    if WEATHER_FROM_CACHE:
+        city_key = _CITY_KEY.format(f"COALESCE(s.weather_city, '{DEFAULT_SETTINGS['weather_city']}')")
+        weather = "w.payload, EXTRACT(EPOCH FROM NOW() - w.fetched_at)"
+        weather_join = f"LEFT JOIN {schema}.weather_cache w ON w.city_key = {city_key} "
+    cur.execute(
+        f"SELECT u.id, u.phone, u.first_name, u.last_name, u.yandex_id, "
+        f"s.theme, s.weather_city, s.timezone_mode, s.notifications_enabled, "
+        f"{weather}, "
+        f"({_favorites_subquery(schema)}) "
+        f"FROM {schema}.users u "
+        f"LEFT JOIN {schema}.user_settings s ON s.user_id = u.id "
+        f"{weather_join}"
+        f"WHERE u.id = %s",
+        (user_id, user_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    profile = {
+        'id': row[0],
+        'phone': row[1],
+        'first_name': row[2],
+        'last_name': row[3],
+        'yandex_id': row[4]
+    }
+    settings = dict(DEFAULT_SETTINGS)
+    if row[5] is not None or row[6] is not None:
+        settings = {
+            'theme': row[5],
+            'weather_city': row[6],
+            'timezone_mode': row[7],
+            'notifications_enabled': row[8]
+        }
+    return profile, settings, row[11], _fresh_weather(row[9], row[10])
+
+
+def cached_weather(cur, schema: str, city: str):
+    if not WEATHER_FROM_CACHE:
+        return None
+    cur.execute(
+        f"SELECT payload, EXTRACT(EPOCH FROM NOW() - fetched_at) "
+        f"FROM {schema}.weather_cache WHERE city_key = {_CITY_KEY.format('%s')}",
+        (city,)
+    )
+    row = cur.fetchone()
+    return _fresh_weather(*row) if row else None
+
+
+def _fresh_weather(payload, age):
+    if payload is None or age is None or float(age) >= WEATHER_MAX_AGE:
+        return None
+    return json.loads(payload)
@@ -1,125 +1,288 @@
-import json
 import os
-import psycopg2
+from search import search_cities, parse_limit, CursorError
+from autocomplete import get_index, MIN_SUBSTRING_LEN
+from timezones import annotate
+from responses import json_response, ndjson_response, not_modified, make_etag, PRIVATE_REVALIDATE
+from runtime import HTTPError, Router, warm_db
+import favorites
 
-def handler(event: dict, context) -> dict:
-    '''API для работы с городами и избранным'''
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    schema = os.environ['MAIN_DB_SCHEMA']
+CATALOG_CACHE = f"public, max-age={os.environ.get('CATALOG_MAX_AGE', '3600')}, stale-while-revalidate=86400"
+LIST_MAX_LIMIT = 500
+STREAM_MAX_ROWS = int(os.environ.get('CATALOG_STREAM_MAX_ROWS', '5000'))
+STREAM_BATCH = 500
+
+def wants_time(params: dict) -> bool:
+    return params.get('with_time', '') in ('1', 'true')
+
+def city_dict(row) -> dict:
+    return {
+        'id': row[0],
+        'name': row[1],
+        'timezone': row[2],
+        'is_capital': row[3],
+        'country': row[4],
+        'latitude': float(row[5]) if row[5] else None,
+        'longitude': float(row[6]) if row[6] else None
+    }
+
+def catalog_etag(index, params: dict):
+    '''ETag ответа справочника: версия каталога и параметры запроса; со временем ответ не кэшируется'''
+    if index.version is None or wants_time(params):
+        return None
+    return make_etag(index.version, sorted(params.items()))
+
+def cities_response(rows: list, next_cursor, with_time: bool = False, event: dict = None,
+                    etag: str = None, cache_control: str = None) -> dict:
+    cities = [city_dict(row) for row in rows]
+    
+    result = {'cities': cities, 'next_cursor': next_cursor}
+    if with_time:
+        result['server_time'] = int(annotate(cities) * 1000)
+        cache_control = cache_control or 'no-cache'
+    
+    return json_response(result, event, cache_control=cache_control or CATALOG_CACHE, etag=etag)
+
+def stream_listing(rows: list, next_cursor, with_time: bool):
+    '''Строки NDJSON: города пачками по STREAM_BATCH, последней — {"next_cursor", "server_time"?}'''
+    ts = None
+    for start in range(0, len(rows), STREAM_BATCH):
+        cities = [city_dict(row) for row in rows[start:start + STREAM_BATCH]]
+        if with_time:
+            ts = annotate(cities)
+        yield from cities
+    tail = {'next_cursor': next_cursor}
+    if with_time:
+        tail['server_time'] = int((ts or annotate([])) * 1000)
+    yield tail
+
+def resolve_targets(body: dict, schema: str) -> list:
+    '''Города и пояса из city_ids, timezones или targets: [{city_id|timezone, working_hours?}]'''
+    for key in ('targets', 'city_ids', 'timezones'):
+        if not isinstance(body.get(key) or [], list):
+            raise ValueError(f'{key} должен быть списком')
+    items = list(body.get('targets') or [])
+    items += [{'city_id': city_id} for city_id in body.get('city_ids') or []]
+    items += [{'timezone': tz_name} for tz_name in body.get('timezones') or []]
+    
+    targets = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Элементы targets — объекты с city_id или timezone')
+        if item.get('city_id') is not None:
+            city_id = item['city_id']
+            row = get_index(schema).by_id.get(city_id) if isinstance(city_id, int) else None
+            if row is None:
+                raise ValueError(f"Город не найден: {city_id}")
+            target = {'city_id': row[0], 'name': row[1], 'timezone': row[2]}
+        elif isinstance(item.get('timezone'), str) and item['timezone']:
+            target = {'timezone': item['timezone']}
+        else:
+            raise ValueError('Нужен city_id или timezone')
+        if item.get('working_hours'):
+            target['working_hours'] = item['working_hours']
+        targets.append(target)
+    return targets
+
+router = Router(allow_headers='Content-Type, X-Authorization')
+
+@router.route('POST', action='convert')
+def convert_handler(req) -> dict:
+    # numpy нужен только здесь: не тянем его в холодный старт остальных запросов
+    from convert import convert, parse_timestamps
     
+    body = req.body
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters', {})
-            search = params.get('search', '')
-            country = params.get('country', '')
-            
-            cur = conn.cursor()
-            
-            if search:
-                cur.execute(
-                    f"SELECT c.id, c.name, c.timezone, c.is_capital, co.name as country, c.latitude, c.longitude "
-                    f"FROM {schema}.cities c "
-                    f"JOIN {schema}.countries co ON c.country_id = co.id "
-                    f"WHERE LOWER(c.name) LIKE %s OR LOWER(co.name) LIKE %s "
-                    f"ORDER BY c.is_capital DESC, c.name",
-                    (f'%{search.lower()}%', f'%{search.lower()}%')
-                )
-            elif country:
-                cur.execute(
-                    f"SELECT c.id, c.name, c.timezone, c.is_capital, co.name as country, c.latitude, c.longitude "
-                    f"FROM {schema}.cities c "
-                    f"JOIN {schema}.countries co ON c.country_id = co.id "
-                    f"WHERE co.name = %s "
-                    f"ORDER BY c.is_capital DESC, c.name",
-                    (country,)
-                )
-            else:
-                cur.execute(
-                    f"SELECT c.id, c.name, c.timezone, c.is_capital, co.name as country, c.latitude, c.longitude "
-                    f"FROM {schema}.cities c "
-                    f"JOIN {schema}.countries co ON c.country_id = co.id "
-                    f"ORDER BY c.is_capital DESC, c.name LIMIT 50"
-                )
-            
-            cities = []
-            for row in cur.fetchall():
-                cities.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'timezone': row[2],
-                    'is_capital': row[3],
-                    'country': row[4],
-                    'latitude': float(row[5]) if row[5] else None,
-                    'longitude': float(row[6]) if row[6] else None
-                })
-            
-            cur.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'cities': cities}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
-            body = json.loads(event.get('body', '{}'))
-            city_id = body.get('city_id')
-            
-            cur = conn.cursor()
-            cur.execute(
-                f"SELECT user_id FROM {schema}.sessions WHERE token = %s AND expires_at > NOW()",
-                (token,)
-            )
-            result = cur.fetchone()
-            
-            if not result:
-                cur.close()
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недействительный токен'}),
-                    'isBase64Encoded': False
-                }
-            
-            user_id = result[0]
-            
-            cur.execute(
-                f"INSERT INTO {schema}.user_favorites (user_id, city_id) VALUES (%s, %s) "
-                f"ON CONFLICT (user_id, city_id) DO NOTHING",
-                (user_id, city_id)
-            )
-            conn.commit()
+        ts = parse_timestamps(body)
+        targets = resolve_targets(body, req.schema)
+        result = convert(ts, targets, body.get('from_timezone') or 'UTC', bool(body.get('include_local')))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    
+    return json_response(result, req.event)
+
+@router.route('POST', action='plan')
+def plan_handler(req) -> dict:
+    from planner import parse_int, plan
+    
+    body = req.body
+    try:
+        result = plan(
+            resolve_targets(body, req.schema),
+            body.get('date_from'),
+            body.get('date_to'),
+            body.get('working_hours'),
+            body.get('weekdays'),
+            parse_int(body.get('duration_minutes', 30), 'duration_minutes') * 60,
+            min(parse_int(body.get('limit', 20), 'limit'), 100)
+        )
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    
+    return json_response(result, req.event)
+
+@router.route('GET', param='bootstrap')
+def bootstrap_handler(req) -> dict:
+    '''Всё для первого экрана: профиль, настройки, избранное со временем, погода и стартовый список городов'''
+    # Индекс берём до соединения: при перестройке он сам займёт соединение из пула
+    index = get_index(req.schema)
+    profile, settings, favorite_rows, weather = None, dict(favorites.DEFAULT_SETTINGS), [], None
+    
+    cur = req.conn.cursor()
+    if req.token:
+        data = favorites.bootstrap(cur, req.schema, req.user_id(cur))
+        if data is None:
             cur.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        conn.close()
+            raise HTTPError(401, 'Недействительный токен')
+        profile, settings, favorite_rows, weather = data
+    else:
+        weather = favorites.cached_weather(cur, req.schema, settings['weather_city'])
+    cur.close()
+    
+    favorite_ids = {row[0] for row in favorite_rows}
+    cities = [city_dict(row) for row in index.rows[:50]]
+    for city in cities:
+        city['isFavorite'] = city['id'] in favorite_ids
+    favorite_cities = [city_dict(row) for row in favorite_rows]
+    ts = annotate(favorite_cities)
+    
+    return json_response({
+        'profile': profile,
+        'settings': settings,
+        'favorites': favorite_cities,
+        'weather': weather,
+        'cities': cities,
+        'server_time': int(ts * 1000)
+    }, req.event, cache_control=PRIVATE_REVALIDATE)
+
+@router.route('GET', read_only=True)
+def catalog_handler(req) -> dict:
+    '''Поиск или листание справочника (всего или городов страны) по курсору
+
+    Листание: ?country=&limit=&cursor=, порядок — столицы, затем по названию и id.
+    С ?format=ndjson города идут по одному на строку, до CATALOG_STREAM_MAX_ROWS
+    за ответ, последняя строка — {"next_cursor": ...}.
+    '''
+    params = req.params
+    # Версия справочника известна из индекса в памяти: 304 отдаём без БД
+    index = get_index(req.schema)
+    etag = catalog_etag(index, params)
+    cached = not_modified(req.event, etag, CATALOG_CACHE)
+    if cached is not None:
+        return cached
+    
+    search = params.get('search', '')
+    country = params.get('country', '')
+    
+    if search:
+        limit = parse_limit(params.get('limit'))
+        try:
+            rows, next_cursor = index.search(search, limit, params.get('cursor', ''))
+            # Пусто в памяти — возможна опечатка, её найдёт нечёткий поиск в БД
+            if not rows and len(search.strip()) >= MIN_SUBSTRING_LEN:
+                cur = req.conn.cursor()
+                try:
+                    rows, next_cursor = search_cities(cur, req.schema, search, limit, params.get('cursor', ''))
+                finally:
+                    cur.close()
+        except CursorError as e:
+            raise HTTPError(400, str(e))
+        return cities_response(rows, next_cursor, wants_time(params), req.event, etag)
+    
+    # Листание идёт по индексу в памяти (или снимку): страница — срез, память ограничена размером страницы
+    stream = params.get('format') == 'ndjson'
+    limit = parse_limit(params.get('limit'), STREAM_MAX_ROWS if stream else 50,
+                        STREAM_MAX_ROWS if stream else LIST_MAX_LIMIT)
+    try:
+        rows, next_cursor = index.listing(country, limit, params.get('cursor', ''))
+    except CursorError as e:
+        raise HTTPError(400, str(e))
+    
+    if stream:
+        cache_control = 'no-cache' if wants_time(params) else CATALOG_CACHE
+        return ndjson_response(stream_listing(rows, next_cursor, wants_time(params)), req.event, cache_control, etag)
+    return cities_response(rows, next_cursor, wants_time(params), req.event, etag)
+
+@router.route('GET', param='lat')
+def nearby_handler(req) -> dict:
+    '''k ближайших к точке городов (?lat=&lon=&k=) и часовой пояс ближайшего'''
+    # Дерево строится при первом запросе на версию справочника, как и индекс поиска
+    from nearby import get_tree, parse_point
+    
+    params = req.params
+    try:
+        lat, lon, k = parse_point(params)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    
+    index = get_index(req.schema)
+    etag = catalog_etag(index, params)
+    cached = not_modified(req.event, etag, CATALOG_CACHE)
+    if cached is not None:
+        return cached
+    
+    cities = [dict(city_dict(row), distance_km=round(km, 1)) for km, row in get_tree(index).nearest(lat, lon, k)]
+    result = {'cities': cities, 'timezone': cities[0]['timezone'] if cities else None}
+    cache_control = CATALOG_CACHE
+    if wants_time(params):
+        result['server_time'] = int(annotate(cities) * 1000)
+        cache_control = 'no-cache'
+    
+    return json_response(result, req.event, cache_control=cache_control, etag=etag)
+
+@router.route('GET', param='favorites')
+def list_favorites_handler(req) -> dict:
+    cur = req.conn.cursor()
+    rows = favorites.list_favorites(cur, req.schema, req.user_id(cur))
+    cur.close()
+    return cities_response(rows, None, wants_time(req.params), req.event, cache_control=PRIVATE_REVALIDATE)
+
+@router.route('POST')
+def add_favorite_handler(req) -> dict:
+    cur = req.conn.cursor()
+    try:
+        favorites.add_favorite(cur, req.schema, req.user_id(cur), req.body.get('city_id'))
+    except ValueError as e:
+        cur.close()
+        raise HTTPError(400, str(e))
+    req.conn.commit()
+    cur.close()
+    return json_response({'success': True})
+
+@router.route('POST', action='reorder')
+def reorder_favorites_handler(req) -> dict:
+    cur = req.conn.cursor()
+    try:
+        favorites.reorder_favorites(cur, req.schema, req.user_id(cur), req.body.get('city_ids'))
+    except ValueError as e:
+        cur.close()
+        raise HTTPError(400, str(e))
+    req.conn.commit()
+    cur.close()
+    return json_response({'success': True})
+
+@router.route('DELETE')
+def delete_favorite_handler(req) -> dict:
+    city_id = req.params.get('city_id') or req.body.get('city_id')
+    cur = req.conn.cursor()
+    try:
+        deleted = favorites.delete_favorite(cur, req.schema, req.user_id(cur), city_id)
+    except ValueError as e:
+        cur.close()
+        raise HTTPError(400, str(e))
+    req.conn.commit()
+    cur.close()
+    return json_response({'success': True, 'deleted': deleted})
+
+@router.warmup
+def warm_catalog():
+    '''Пул, индексы справочника и таблицы переходов поясов до первого пользователя'''
+    warm_db()
+    index = get_index(os.environ['MAIN_DB_SCHEMA'])
+    annotate([{'timezone': tz_name} for tz_name in index.timezone_names()])
+    import planner  # noqa: F401
+    from nearby import get_tree
+    get_tree(index)
+
+def handler(event: dict, context) -> dict:
+    '''API для работы с городами и избранным'''
+    return router(event, context)
@@ -0,0 +1,170 @@
+'''Инструментирование вызова: время фаз, запросы к БД и медленные запросы.
+
+TRACE_MODE — список через запятую:
+    log    — на каждый вызов строка {"trace": {...}} в stdout (логи функции)
+    header — заголовок Server-Timing в ответе (виден в DevTools)
+Фазы: connect (соединение из пула), auth (проверка токена), query (все
+запросы к БД), upstream (внешние HTTP), serialize и compress (тело ответа).
+Фазы могут вкладываться: запрос внутри auth учитывается и в query.
+
+SLOW_QUERY_MS > 0 пишет строку {"slow_query": {...}} для каждого запроса
+дольше порога — текст SQL без параметров, чтобы в лог не попали токены.
+
+Без TRACE_MODE и SLOW_QUERY_MS span() возвращает общий пустой контекст, а
+psycopg2 создаёт обычные курсоры: накладные расходы — одна проверка флага.
+
+Модуль одинаково лежит в каждой функции: функции деплоятся независимо.
+'''
+import json
+import os
+import threading
+import time
+
+MODES = {mode.strip() for mode in os.environ.get('TRACE_MODE', '').split(',') if mode.strip()}
+LOG = 'log' in MODES
+HEADER = 'header' in MODES
+ENABLED = LOG or HEADER
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+SQL_PREVIEW_CHARS = 300
+
+_local = threading.local()
+_cursor_class = None
+
+
+class Trace:
+    __slots__ = ('started', 'spans', 'queries', 'rows')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = 0
+        self.rows = 0
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    '''Контекст, добавляющий своё время к фазе name текущего вызова'''
+    if not ENABLED:
+        return _NO_SPAN
+    trace = getattr(_local, 'trace', None)
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+def begin():
+    '''Начинает трассировку вызова в текущем потоке; None, если она выключена'''
+    if not ENABLED:
+        return None
+    trace = _local.trace = Trace()
+    return trace
+
+
+def server_timing(trace: Trace, total: float) -> str:
+    parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in trace.spans.items()]
+    parts.append(f'db;desc="{trace.queries} q, {trace.rows} rows"')
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def finish(trace, response: dict, method: str, route: str) -> dict:
+    '''Завершает трассировку: пишет строку лога и/или добавляет Server-Timing'''
+    if trace is None:
+        return response
+    _local.trace = None
+    total = time.perf_counter() - trace.started
+    if LOG:
+        print(json.dumps({'trace': {
+            'method': method,
+            'route': route,
+            'status': response.get('statusCode'),
+            'total_ms': round(total * 1000, 3),
+            'spans_ms': {name: round(seconds * 1000, 3) for name, seconds in trace.spans.items()},
+            'queries': trace.queries,
+            'rows': trace.rows
+        }}))
+    if HEADER:
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = server_timing(trace, total)
+        headers['Timing-Allow-Origin'] = '*'
+        expose = headers.get('Access-Control-Expose-Headers')
+        headers['Access-Control-Expose-Headers'] = f'{expose}, Server-Timing' if expose else 'Server-Timing'
+        response = dict(response, headers=headers)
+    return response
+
+
+def _sql_text(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return ' '.join(str(query).split())[:SQL_PREVIEW_CHARS]
+
+
+def _record(cur, query, seconds: float):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.add('query', seconds)
+        trace.queries += 1
+        if cur.rowcount > 0:
+            trace.rows += cur.rowcount
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        print(json.dumps({'slow_query': {
+            'ms': round(seconds * 1000, 3),
+            'rows': cur.rowcount,
+            'sql': _sql_text(query)
+        }}, ensure_ascii=False))
+
+
+def cursor_factory():
+    '''Класс курсора, который замеряет запросы, или None, если замерять нечего'''
+    global _cursor_class
+    if not ENABLED and not SLOW_QUERY_MS:
+        return None
+    if _cursor_class is None:
+        import psycopg2.extensions
+
+        class TracedCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _record(self, query, time.perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record(self, query, time.perf_counter() - started)
+
+        _cursor_class = TracedCursor
+    return _cursor_class
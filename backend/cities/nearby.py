@@ -0,0 +1,153 @@
+'''Ближайшие города и часовой пояс по координатам.
+
+k-d дерево строится из снимка справочника (autocomplete.CityIndex) один
+раз на версию каталога; в файловом снимке (snapshot.py) оно уже лежит готовым. Города хранятся как единичные векторы, расстояние
+— хорда, монотонная с дугой большого круга, поэтому нет проблем ни с
+антимеридианом, ни с полюсами. Дерево неявное: точки переупорядочены так,
+что середина каждого отрезка — узел разбиения, а в axes лежит его ось.
+При поиске дальняя ветвь отсекается по нижней оценке расстояния до её
+области, накопленной по осям (как у Arya–Mount).
+'''
+import heapq
+import math
+import threading
+from operator import itemgetter
+
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 12
+MAX_K = 50
+
+_AXIS_KEYS = (itemgetter(0), itemgetter(1), itemgetter(2))
+
+
+def _vector(lat: float, lon: float) -> tuple:
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    cos_phi = math.cos(phi)
+    return cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi)
+
+
+def chord_to_km(squared_chord: float) -> float:
+    return 2 * math.asin(min(1.0, math.sqrt(squared_chord) / 2)) * EARTH_RADIUS_KM
+
+
+class NearbyTree:
+    def __init__(self, rows: list):
+        self.rows = rows
+        points = [
+            _vector(float(row[5]), float(row[6])) + (idx,)
+            for idx, row in enumerate(rows)
+            if row[5] is not None and row[6] is not None
+        ]
+        size = len(points)
+        axes = [0] * size
+        stack = [(0, size)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            segment = points[lo:hi]
+            spreads = [max(p[a] for p in segment) - min(p[a] for p in segment) for a in range(3)]
+            axis = spreads.index(max(spreads))
+            segment.sort(key=_AXIS_KEYS[axis])
+            points[lo:hi] = segment
+            mid = (lo + hi) // 2
+            axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+        self.size = size
+        self.axes = axes
+        self.coords = ([p[0] for p in points], [p[1] for p in points], [p[2] for p in points])
+        self.order = [p[3] for p in points]
+
+    @classmethod
+    def from_arrays(cls, rows, coords: tuple, axes, order) -> 'NearbyTree':
+        '''Готовое дерево из снимка справочника (snapshot.py) без перестроения'''
+        tree = cls.__new__(cls)
+        tree.rows = rows
+        tree.size = len(order)
+        tree.axes = axes
+        tree.coords = coords
+        tree.order = order
+        return tree
+
+    def nearest(self, lat: float, lon: float, k: int) -> list:
+        '''[(км, строка)] k ближайших городов по возрастанию расстояния'''
+        k = min(k, self.size)
+        if k <= 0:
+            return []
+        q = _vector(lat, lon)
+        qx, qy, qz = q
+        coords = self.coords
+        xs, ys, zs = coords
+        axes = self.axes
+        heap = []
+        offsets = [0.0, 0.0, 0.0]
+
+        def consider(i: int):
+            d = (xs[i] - qx) ** 2 + (ys[i] - qy) ** 2 + (zs[i] - qz) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, (-d, i))
+            elif d < -heap[0][0]:
+                heapq.heapreplace(heap, (-d, i))
+
+        def visit(lo: int, hi: int, bound: float):
+            if hi - lo <= LEAF_SIZE:
+                for i in range(lo, hi):
+                    consider(i)
+                return
+            mid = (lo + hi) // 2
+            axis = axes[mid]
+            diff = q[axis] - coords[axis][mid]
+            consider(mid)
+            if diff < 0:
+                visit(lo, mid, bound)
+                far_lo, far_hi = mid + 1, hi
+            else:
+                visit(mid + 1, hi, bound)
+                far_lo, far_hi = lo, mid
+            previous = offsets[axis]
+            far_bound = bound - previous * previous + diff * diff
+            if len(heap) < k or far_bound < -heap[0][0]:
+                offsets[axis] = diff
+                visit(far_lo, far_hi, far_bound)
+                offsets[axis] = previous
+
+        visit(0, self.size, 0.0)
+        found = sorted((-neg, i) for neg, i in heap)
+        return [(chord_to_km(d), self.rows[self.order[i]]) for d, i in found]
+
+
+_tree = None
+_tree_source = None
+_lock = threading.Lock()
+
+
+def get_tree(index) -> NearbyTree:
+    '''Дерево для текущего снимка справочника; перестраивается вместе с ним'''
+    global _tree, _tree_source
+    if _tree_source is index:
+        return _tree
+    with _lock:
+        if _tree_source is not index:
+            # Снимок из файла хранит дерево готовым
+            _tree = index.nearby_tree() if hasattr(index, 'nearby_tree') else NearbyTree(index.rows)
+            _tree_source = index
+    return _tree
+
+
+def parse_point(params: dict) -> tuple:
+    '''(широта, долгота, k) из параметров запроса; ValueError при ошибке'''
+    try:
+        lat = float(params.get('lat'))
+        lon = float(params.get('lon'))
+    except (TypeError, ValueError):
+        raise ValueError('lat и lon должны быть числами')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Координаты вне диапазона')
+    try:
+        k = int(params.get('k') or 5)
+    except ValueError:
+        raise ValueError('k должно быть числом')
+    return lat, lon, max(1, min(k, MAX_K))
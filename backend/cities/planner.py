@@ -0,0 +1,178 @@
+'''Планировщик встреч: общие рабочие часы для многих часовых поясов.
+
+Работает на интервалах, а не по минутам: для каждого города рабочие окна
+переводятся в UTC по отрезкам постоянного смещения из таблиц переходов
+(поэтому смена летнего времени внутри диапазона учитывается сама), затем
+списки интервалов всех городов пересекаются слиянием. Сложность —
+O(города × (дни + переходы)).
+'''
+import os
+from datetime import date, datetime, timezone
+
+from timezones import DAY, format_offset, get_table
+
+MAX_DAYS = int(os.environ.get('PLANNER_MAX_DAYS', '366'))
+MAX_TARGETS = int(os.environ.get('PLANNER_MAX_TARGETS', '100'))
+DEFAULT_HOURS = {'start': '09:00', 'end': '18:00'}
+DEFAULT_WEEKDAYS = (1, 2, 3, 4, 5)
+
+
+class PlannerError(ValueError):
+    pass
+
+
+def _parse_clock(value: str) -> int:
+    try:
+        hours, minutes = str(value).split(':')
+        seconds = int(hours) * 3600 + int(minutes) * 60
+    except ValueError:
+        raise PlannerError(f'Некорректное время: {value}')
+    if not 0 <= seconds <= DAY:
+        raise PlannerError(f'Некорректное время: {value}')
+    return seconds
+
+
+def parse_window(hours: dict) -> tuple:
+    '''(начало, конец) в секундах от полуночи; ночная смена переходит через сутки'''
+    if not isinstance(hours, dict):
+        raise PlannerError('working_hours — объект {start, end}')
+    start = _parse_clock(hours.get('start', DEFAULT_HOURS['start']))
+    end = _parse_clock(hours.get('end', DEFAULT_HOURS['end']))
+    if end <= start:
+        end += DAY
+    return start, end
+
+
+def parse_weekdays(weekdays) -> set:
+    '''Дни недели 1–7 (понедельник — 1); по умолчанию будни'''
+    if not weekdays:
+        return set(DEFAULT_WEEKDAYS)
+    if not isinstance(weekdays, list) or not all(
+            isinstance(day, int) and not isinstance(day, bool) and 1 <= day <= 7 for day in weekdays):
+        raise PlannerError('weekdays — список дней недели от 1 до 7')
+    return set(weekdays)
+
+
+def parse_int(value, name: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise PlannerError(f'{name} должен быть числом')
+    try:
+        return int(value)
+    except ValueError:
+        raise PlannerError(f'{name} должен быть числом')
+
+
+def parse_range(date_from: str, date_to: str) -> tuple:
+    try:
+        first = date.fromisoformat(date_from)
+        last = date.fromisoformat(date_to)
+    except (TypeError, ValueError):
+        raise PlannerError('date_from и date_to в формате ГГГГ-ММ-ДД')
+    days = (last - first).days + 1
+    if days <= 0:
+        raise PlannerError('date_to раньше date_from')
+    if days > MAX_DAYS:
+        raise PlannerError(f'Диапазон не длиннее {MAX_DAYS} дней')
+    start = int(datetime(first.year, first.month, first.day, tzinfo=timezone.utc).timestamp())
+    return start, start + days * DAY
+
+
+def working_intervals(tz_name: str, window: tuple, weekdays, range_start: int, range_end: int) -> list:
+    '''Рабочие интервалы города в UTC внутри [range_start, range_end)'''
+    # Запас в сутки с каждой стороны: местный день может начаться раньше UTC
+    table = get_table(tz_name, range_start - 2 * DAY, range_end + 2 * DAY)
+    if table is None:
+        raise PlannerError(f'Неизвестный часовой пояс: {tz_name}')
+    ws, we = window
+    intervals = []
+    starts = table.starts
+    for i, seg_start in enumerate(starts):
+        seg_end = starts[i + 1] if i + 1 < len(starts) else table.end
+        seg_start, seg_end = max(seg_start, range_start - DAY), min(seg_end, range_end + DAY)
+        if seg_start >= seg_end:
+            continue
+        offset = table.infos[i][0]
+        local_start, local_end = seg_start + offset, seg_end + offset
+        # Окно ночной смены, начатое накануне, тоже может попасть в отрезок
+        for day in range(local_start // DAY - 1, (local_end - 1) // DAY + 1):
+            # 1970-01-01 — четверг
+            if (day + 3) % 7 + 1 not in weekdays:
+                continue
+            a = max(day * DAY + ws, local_start) - offset
+            b = min(day * DAY + we, local_end) - offset
+            a, b = max(a, range_start), min(b, range_end)
+            if a < b:
+                intervals.append((a, b))
+
+    intervals.sort()
+    merged = []
+    for a, b in intervals:
+        if merged and a <= merged[-1][1]:
+            if b > merged[-1][1]:
+                merged[-1] = (merged[-1][0], b)
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def intersect(left: list, right: list) -> list:
+    result = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        a = max(left[i][0], right[j][0])
+        b = min(left[i][1], right[j][1])
+        if a < b:
+            result.append((a, b))
+        if left[i][1] < right[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def _iso(ts: int, offset: int = None) -> str:
+    '''UTC с суффиксом Z или местное время со смещением'''
+    local = datetime.fromtimestamp(ts + (offset or 0), timezone.utc).replace(tzinfo=None).isoformat()
+    return local + ('Z' if offset is None else format_offset(offset))
+
+
+def plan(targets: list, date_from: str, date_to: str, hours: dict = None, weekdays=None,
+         min_duration: int = 1800, limit: int = 20) -> dict:
+    '''targets: [{'timezone': ..., 'working_hours'?: {...}, ...}].
+
+    Слоты сортируются по длительности, при равной — по времени начала.
+    '''
+    if not targets:
+        raise PlannerError('Не указаны города или часовые пояса')
+    if len(targets) > MAX_TARGETS:
+        raise PlannerError(f'Не больше {MAX_TARGETS} городов за запрос')
+    range_start, range_end = parse_range(date_from, date_to)
+    default_window = parse_window(hours or DEFAULT_HOURS)
+    weekdays = parse_weekdays(weekdays)
+
+    common = [(range_start, range_end)]
+    for target in targets:
+        window = parse_window(target['working_hours']) if target.get('working_hours') else default_window
+        common = intersect(common, working_intervals(target['timezone'], window, weekdays, range_start, range_end))
+        if not common:
+            break
+
+    slots = [(a, b) for a, b in common if b - a >= min_duration]
+    slots.sort(key=lambda s: (s[0] - s[1], s[0]))
+
+    result = []
+    for a, b in slots[:limit]:
+        local = []
+        for target in targets:
+            table = get_table(target['timezone'], a)
+            entry = {k: v for k, v in target.items() if k != 'working_hours'}
+            entry['start'] = _iso(a, table.lookup(a)[0])
+            entry['end'] = _iso(b, table.lookup(b)[0])
+            local.append(entry)
+        result.append({
+            'start': _iso(a),
+            'end': _iso(b),
+            'duration_minutes': (b - a) // 60,
+            'local': local
+        })
+    return {'slots': result, 'total_slots': len(slots)}
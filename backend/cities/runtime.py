@@ -0,0 +1,222 @@
+'''Общий каркас обработчиков: таблица маршрутов, готовые заголовки, ленивая БД.
+
+Маршрут выбирается по методу, затем по полю action в теле или по наличию
+параметра запроса, иначе срабатывает маршрут метода по умолчанию. Тело
+разбирается и соединение из пула берётся только при первом обращении,
+поэтому OPTIONS и ошибки маршрутизации не трогают ни JSON, ни БД.
+
+Прогрев: событие {"warmup": true} или сообщение таймерного триггера
+запускает функции, зарегистрированные через @router.warmup, — они заранее
+импортируют тяжёлые модули и открывают соединения, пока нет пользователей.
+
+Маршрут, объявленный с read_only=True, читает с реплики (db.get_read_conn).
+Если реплика ещё не видит того, что клиент уже видел (новая сессия, свежая
+версия настроек), обработчик вызывает req.require_primary(), и маршрут
+повторяется целиком на основной БД.
+
+Трассировка (TRACE_MODE, см. instrument) охватывает вызов маршрута вместе
+с возвратом соединения в пул; OPTIONS и прогрев не трассируются.
+
+Модуль одинаково лежит в каждой функции: функции деплоятся независимо.
+'''
+import os
+import time
+
+import instrument
+from responses import CORS_HEADERS, error_response, json_response, loads
+
+
+class HTTPError(Exception):
+    '''Прерывает обработку ответом {"error": message} с кодом status'''
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class PrimaryRequired(Exception):
+    '''Реплика отстала: маршрут нужно повторить на основной БД'''
+
+
+class Request:
+    def __init__(self, event: dict):
+        self.event = event
+        self.method = event.get('httpMethod', 'GET')
+        self.params = event.get('queryStringParameters') or {}
+        self.read_only = False
+        self._body = None
+        self._conn = None
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            raw = self.event.get('body') or '{}'
+            try:
+                body = loads(raw)
+            except ValueError:
+                raise HTTPError(400, 'Некорректный JSON')
+            self._body = body if isinstance(body, dict) else {}
+        return self._body
+
+    @property
+    def schema(self) -> str:
+        return os.environ['MAIN_DB_SCHEMA']
+
+    @property
+    def conn(self):
+        '''Соединение из пула, взятое при первом обращении и возвращаемое после ответа'''
+        if self._conn is None:
+            import db
+            self._conn = db.get_read_conn() if self.read_only else db.get_conn()
+        return self._conn
+
+    @property
+    def on_replica(self) -> bool:
+        if self._conn is None:
+            return False
+        import db
+        return db.is_replica(self._conn)
+
+    def require_primary(self):
+        '''На реплике — прерывает обработку, чтобы повторить её на основной БД'''
+        if self.on_replica:
+            raise PrimaryRequired()
+
+    @property
+    def token(self) -> str:
+        import sessions
+        return sessions.get_token(self.event)
+
+    def user_id(self, cur) -> int:
+        '''Владелец токена; без действующей сессии — HTTPError 401'''
+        import sessions
+        with instrument.span('auth'):
+            user_id = sessions.resolve_user(cur, self.schema, self.token)
+        if user_id is None:
+            cur.close()
+            # Сессия могла ещё не дойти до реплики
+            self.require_primary()
+            raise HTTPError(401, 'Недействительный токен')
+        return user_id
+
+    def close(self):
+        if self._conn is not None:
+            import db
+            db.put_conn(self._conn)
+            self._conn = None
+
+
+def warm_db():
+    '''Импортирует драйвер и кладёт в пул открытое соединение'''
+    import db
+    db.put_conn(db.get_conn())
+
+
+class Router:
+    '''Таблица маршрутов функции; сам объект — точка входа handler(event, context)'''
+
+    def __init__(self, allow_headers: str = 'Content-Type'):
+        self._defaults = {}
+        self._actions = {}
+        self._params = {}
+        self._read_only = set()
+        self._allow_headers = allow_headers
+        self._options = None
+        self._warmers = []
+
+    def route(self, method: str, action: str = None, param: str = None, read_only: bool = False):
+        def register(fn):
+            if read_only:
+                self._read_only.add(fn)
+            if action is not None:
+                self._actions.setdefault(method, {})[action] = fn
+            elif param is not None:
+                self._params.setdefault(method, []).append((param, fn))
+            else:
+                self._defaults[method] = fn
+            self._options = None
+            return fn
+        return register
+
+    def warmup(self, fn):
+        '''Регистрирует fn() для вызова по событию прогрева'''
+        self._warmers.append(fn)
+        return fn
+
+    @staticmethod
+    def is_warmup(event: dict) -> bool:
+        return bool(event.get('warmup')) or ('httpMethod' not in event and 'messages' in event)
+
+    def _warm(self) -> dict:
+        started = time.perf_counter()
+        errors = {}
+        # Заодно подгружаем orjson, который responses импортирует лениво
+        loads('{}')
+        for fn in self._warmers:
+            try:
+                fn()
+            except Exception as e:
+                errors[fn.__name__] = str(e)
+        return json_response({
+            'warm': not errors,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'errors': errors
+        })
+
+    def _options_response(self) -> dict:
+        if self._options is None:
+            methods = sorted({*self._defaults, *self._actions, *self._params} | {'OPTIONS'})
+            self._options = {
+                'statusCode': 200,
+                'headers': dict(
+                    CORS_HEADERS,
+                    **{
+                        'Access-Control-Allow-Methods': ', '.join(methods),
+                        'Access-Control-Allow-Headers': self._allow_headers,
+                        'Access-Control-Max-Age': '86400'
+                    }
+                ),
+                'body': '',
+                'isBase64Encoded': False
+            }
+        return self._options
+
+    def resolve(self, req: Request):
+        method = req.method
+        for param, fn in self._params.get(method, ()):
+            if req.params.get(param):
+                return fn
+        actions = self._actions.get(method)
+        if actions:
+            fn = actions.get(req.body.get('action'))
+            if fn is not None:
+                return fn
+        return self._defaults.get(method)
+
+    def __call__(self, event: dict, context) -> dict:
+        if event.get('httpMethod') == 'OPTIONS':
+            return self._options_response()
+        if self.is_warmup(event):
+            return self._warm()
+
+        req = Request(event)
+        trace = instrument.begin()
+        fn = None
+        try:
+            fn = self.resolve(req)
+            if fn is None:
+                response = error_response(405, 'Метод не поддерживается')
+            else:
+                req.read_only = fn in self._read_only
+                try:
+                    response = fn(req)
+                except PrimaryRequired:
+                    req.close()
+                    req.read_only = False
+                    response = fn(req)
+        except HTTPError as e:
+            response = error_response(e.status, e.message)
+        finally:
+            req.close()
+        return instrument.finish(trace, response, req.method, fn.__name__ if fn else None)
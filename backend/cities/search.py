@@ -0,0 +1,106 @@
+'''Ранжированный постраничный поиск городов по названию города и страны'''
+import base64
+import json
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 100
+# Короче этого триграммы бесполезны: ищем только по началу названия
+MIN_SUBSTRING_LEN = 3
+
+_trgm_available = None
+
+
+class CursorError(ValueError):
+    pass
+
+
+def parse_limit(value, default: int = DEFAULT_LIMIT, maximum: int = MAX_LIMIT) -> int:
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(score: int, name: str, city_id: int) -> str:
+    raw = json.dumps([score, name, city_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, name, city_id = json.loads(raw.decode('utf-8'))
+        return int(score), str(name), int(city_id)
+    except (ValueError, TypeError):
+        raise CursorError('Некорректный курсор')
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _has_trgm(cur) -> bool:
+    global _trgm_available
+    if _trgm_available is None:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trgm_available = cur.fetchone() is not None
+    return _trgm_available
+
+
+def search_cities(cur, schema: str, query: str, limit: int, cursor: str = '') -> tuple:
+    '''Возвращает (строки городов, курсор следующей страницы или None).
+
+    Ранг: начало названия > подстрока в городе или стране > нечёткое совпадение,
+    столица поднимается внутри своей группы.
+    '''
+    q = query.strip().lower()
+    escaped = _escape_like(q)
+    params = {'q': q, 'prefix': escaped + '%', 'sub': '%' + escaped + '%', 'limit': limit + 1}
+
+    if len(q) < MIN_SUBSTRING_LEN:
+        match = (
+            f"LOWER(c.name) LIKE %(prefix)s "
+            f"OR c.country_id IN (SELECT id FROM {schema}.countries WHERE LOWER(name) LIKE %(prefix)s)"
+        )
+        country_rank = "LOWER(co.name) LIKE %(prefix)s"
+    else:
+        match = (
+            f"LOWER(c.name) LIKE %(sub)s "
+            f"OR c.country_id IN (SELECT id FROM {schema}.countries WHERE LOWER(name) LIKE %(sub)s)"
+        )
+        if _has_trgm(cur):
+            match += " OR LOWER(c.name) %% %(q)s"
+        country_rank = "LOWER(co.name) LIKE %(sub)s"
+
+    after = ''
+    if cursor:
+        params['c_score'], params['c_name'], params['c_id'] = decode_cursor(cursor)
+        after = (
+            "WHERE r.score < %(c_score)s "
+            "OR (r.score = %(c_score)s AND (r.name, r.id) > (%(c_name)s, %(c_id)s)) "
+        )
+
+    cur.execute(
+        f"SELECT r.id, r.name, r.timezone, r.is_capital, r.country, r.latitude, r.longitude, r.score FROM ("
+        f"SELECT c.id, c.name, c.timezone, c.is_capital, co.name AS country, c.latitude, c.longitude, "
+        f"(CASE WHEN LOWER(c.name) LIKE %(prefix)s THEN 3 "
+        f"WHEN LOWER(c.name) LIKE %(sub)s OR {country_rank} THEN 2 "
+        f"ELSE 1 END) * 2 + (CASE WHEN c.is_capital THEN 1 ELSE 0 END) AS score "
+        f"FROM {schema}.cities c "
+        f"JOIN {schema}.countries co ON c.country_id = co.id "
+        f"WHERE {match}"
+        f") r "
+        f"{after}"
+        f"ORDER BY r.score DESC, r.name, r.id "
+        f"LIMIT %(limit)s",
+        params
+    )
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[7], last[1], last[0])
+    return [row[:7] for row in rows], next_cursor
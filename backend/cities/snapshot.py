@@ -0,0 +1,500 @@
+'''Снимок справочника городов в бинарном файле, отображаемом в память.
+
+Сборка (DATABASE_URL и MAIN_DB_SCHEMA как у функции) после каждой миграции
+или правки справочника; catalog_import.py запускает её сам после загрузки:
+    python snapshot.py [--output catalog.snapshot] [--no-publish]
+
+Собранный снимок публикуется в таблицу catalog_snapshot (V0011): функции
+деплоятся из репозитория, поэтому файл им доставляет БД. Сменив версию
+справочника, get_index берёт снимок в таком порядке: файл CITY_SNAPSHOT_PATH
+рядом с функцией, если он подходит; ранее скачанный файл в CITY_SNAPSHOT_DIR
+(по умолчанию — временный каталог); скачивание из catalog_snapshot кусками
+по DOWNLOAD_CHUNK байт; иначе индекс строится из таблиц, как раньше.
+
+Файл содержит всё, что autocomplete.CityIndex и nearby.NearbyTree строят при
+холодном старте: записи городов фиксированной ширины в порядке справочника
+(столицы, затем по названию), таблицы строк, отсортированные ключи поиска,
+склеенные строки для поиска по подстроке, города по странам, индекс по id и
+k-d дерево ближайших городов. Снимок помечен catalog_version и схемой:
+get_index открывает его, только если версия совпадает с БД, иначе строит
+индекс из таблиц как раньше. Открытие — mmap и разбор заголовка, строки
+декодируются по одной при обращении, поэтому время старта и память
+экземпляра не растут вместе со справочником.
+
+Числа пишутся в порядке байт машины сборки; на машине с другим порядком
+заголовок не сойдётся и снимок будет проигнорирован.
+'''
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+
+from autocomplete import CityIndex, TIER_OTHER
+
+MAGIC = 0x53435A54
+FORMAT = 1
+HEADER = struct.Struct('=IIqI')
+SECTION = struct.Struct('=12sQQ')
+# id, смещение и длина названия, номер пояса, номер страны, столица, широта, долгота
+RECORD = struct.Struct('=qIHHH?xdd')
+ALIGN = 8
+DOWNLOAD_DIR = os.environ.get('CITY_SNAPSHOT_DIR', tempfile.gettempdir())
+DOWNLOAD_CHUNK = 4 << 20
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _Strings(Sequence):
+    '''Таблица строк: смещения (n + 1) и UTF-8 блок'''
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+class _Ranges(Sequence):
+    '''Списки номеров строк: пары (начало, конец) в общем пуле'''
+
+    def __init__(self, bounds, pool):
+        self._bounds = bounds
+        self._pool = pool
+
+    def __len__(self):
+        return len(self._bounds) // 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._pool[self._bounds[2 * i]:self._bounds[2 * i + 1]]
+
+
+class _Refs(Sequence):
+    '''(группа ранга, номера строк) для каждого ключа поиска'''
+
+    def __init__(self, tiers, members: _Ranges):
+        self._tiers = tiers
+        self._members = members
+
+    def __len__(self):
+        return len(self._tiers)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._tiers[i], self._members[i]
+
+
+class _Records(Sequence):
+    '''Строки справочника в формате выборки из БД, декодируются при обращении'''
+
+    def __init__(self, records, names, timezones: tuple, countries: tuple):
+        self._records = records
+        self._names = names
+        self._timezones = timezones
+        self._countries = countries
+        self._count = len(records) // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        city_id, offset, length, tz, country, capital, lat, lon = RECORD.unpack_from(self._records, i * RECORD.size)
+        return (
+            city_id,
+            str(self._names[offset:offset + length], 'utf-8'),
+            self._timezones[tz],
+            capital,
+            self._countries[country],
+            None if math.isnan(lat) else lat,
+            None if math.isnan(lon) else lon
+        )
+
+
+class _ById:
+    '''Поиск строки по id бинарным поиском по отсортированным id'''
+
+    def __init__(self, ids, positions, rows: _Records):
+        self._ids = ids
+        self._positions = positions
+        self._rows = rows
+
+    def get(self, city_id, default=None):
+        if not isinstance(city_id, int):
+            return default
+        i = bisect_left(self._ids, city_id)
+        if i == len(self._ids) or self._ids[i] != city_id:
+            return default
+        return self._rows[self._positions[i]]
+
+    def __contains__(self, city_id):
+        return self.get(city_id) is not None
+
+
+class Snapshot(CityIndex):
+    '''CityIndex поверх отображённого в память файла; поиск и ранжирование — унаследованные'''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if len(mm) < HEADER.size:
+            raise SnapshotError('Файл снимка обрезан')
+        magic, fmt, version, count = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise SnapshotError('Неизвестный формат снимка')
+        sections = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(mm, HEADER.size + i * SECTION.size)
+            if offset + length > len(mm):
+                raise SnapshotError('Файл снимка обрезан')
+            sections[name.rstrip(b'\x00').decode('ascii')] = (offset, length)
+        self._sections = sections
+        view = memoryview(mm)
+        self._views = [view]
+
+        def section(name: str, code: str = 'B'):
+            offset, length = sections[name]
+            cast = view[offset:offset + length].cast(code)
+            self._views.append(cast)
+            return cast
+
+        self.version = version
+        self.meta = json.loads(bytes(section('meta')))
+        timezones = tuple(_Strings(section('tz_off', 'I'), section('tz_blob')))
+        country_names = tuple(_Strings(section('co_off', 'I'), section('co_blob')))
+        self.rows = _Records(section('records'), section('names'), timezones, country_names)
+        self.by_id = _ById(section('ids', 'q'), section('id_rows', 'I'), self.rows)
+        self.capitals = self.meta['capitals']
+        co_ranges = _Ranges(section('co_ranges', 'I'), section('co_order', 'I'))
+        self.countries = dict(zip(country_names, co_ranges))
+        self._timezones = timezones
+
+        self._keys = _Strings(section('key_off', 'I'), section('key_blob'))
+        self._refs = _Refs(section('key_tier'), _Ranges(section('key_ranges', 'I'), section('pool', 'I')))
+        self._offsets = section('seg_off', 'I')
+        self._members = _Ranges(section('seg_ranges', 'I'), section('pool', 'I'))
+        self._blob_span = sections['seg_blob']
+        self._tree = tuple(section(name, code) for name, code in (
+            ('tree_x', 'd'), ('tree_y', 'd'), ('tree_z', 'd'), ('tree_axes', 'B'), ('tree_order', 'I')
+        ))
+
+    def timezone_names(self) -> set:
+        return set(self._timezones)
+
+    def _substring_hits(self, q: str, best: dict):
+        # UTF-8 самосинхронизируется: совпадение байтов — совпадение символов
+        needle = q.encode('utf-8')
+        start, length = self._blob_span
+        end = start + length
+        pos = self._mm.find(needle, start, end)
+        while pos != -1:
+            segment = bisect_right(self._offsets, pos - start) - 1
+            for idx in self._members[segment]:
+                best.setdefault(idx, TIER_OTHER)
+            pos = self._mm.find(needle, pos + 1, end)
+
+    def nearby_tree(self):
+        from nearby import NearbyTree
+        xs, ys, zs, axes, order = self._tree
+        return NearbyTree.from_arrays(self.rows, (xs, ys, zs), axes, order)
+
+
+def open_snapshot(path: str, schema: str, version):
+    '''Snapshot, если файл есть и собран для этой схемы и версии каталога, иначе None'''
+    if version is None or not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({'catalog_snapshot': {'path': path, 'error': str(e)}}, ensure_ascii=False))
+        return None
+    if snapshot.version != version or snapshot.meta.get('schema') != schema:
+        print(json.dumps({'catalog_snapshot': {
+            'path': path, 'stale': True, 'version': snapshot.version, 'expected': version
+        }}))
+        return None
+    return snapshot
+
+
+def _download_path(schema: str, version: int) -> str:
+    return os.path.join(DOWNLOAD_DIR, f'catalog-{schema}-{version}.snapshot')
+
+
+def download(cur, schema: str, version: int):
+    '''Файл снимка версии version из catalog_snapshot; путь или None, если такого нет'''
+    path = _download_path(schema, version)
+    if os.path.exists(path):
+        return path
+    cur.execute(
+        f"SELECT octet_length(data) FROM {schema}.catalog_snapshot WHERE id = 1 AND version = %s",
+        (version,)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            for offset in range(0, row[0], DOWNLOAD_CHUNK):
+                cur.execute(
+                    f"SELECT substring(data FROM %s FOR %s) FROM {schema}.catalog_snapshot "
+                    f"WHERE id = 1 AND version = %s",
+                    (offset + 1, DOWNLOAD_CHUNK, version)
+                )
+                chunk = cur.fetchone()
+                if chunk is None:
+                    # Пока качали, опубликовали следующую версию
+                    return None
+                f.write(chunk[0])
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    # Прежние версии больше не нужны: отображённый файл доступен, пока жив его Snapshot
+    prefix = f'catalog-{schema}-'
+    for name in os.listdir(DOWNLOAD_DIR):
+        old = os.path.join(DOWNLOAD_DIR, name)
+        if name.startswith(prefix) and name.endswith('.snapshot') and old != path:
+            try:
+                os.unlink(old)
+            except OSError:
+                pass
+    return path
+
+
+def load_snapshot(cur, schema: str, version, bundled_path: str):
+    '''Snapshot нужной версии: из файла рядом с функцией или скачанный из БД; иначе None'''
+    if version is None:
+        return None
+    snapshot = open_snapshot(bundled_path, schema, version)
+    if snapshot is not None:
+        return snapshot
+    import psycopg2
+    try:
+        path = download(cur, schema, version)
+    except (OSError, psycopg2.Error) as e:
+        # Нет таблицы (не применена V0011) или обрыв: строим индекс из таблиц
+        cur.connection.rollback()
+        print(json.dumps({'catalog_snapshot': {'download_error': str(e)}}, ensure_ascii=False))
+        return None
+    return open_snapshot(path, schema, version) if path else None
+
+
+def _strings(values) -> tuple:
+    offsets = array('I', [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets.tobytes(), bytes(blob)
+
+
+def compile_index(index: CityIndex, schema: str) -> dict:
+    '''Секции снимка {имя: bytes} из построенного индекса'''
+    from nearby import NearbyTree
+
+    rows = index.rows
+    timezones = sorted({row[2] for row in rows})
+    tz_numbers = {name: i for i, name in enumerate(timezones)}
+    country_names = sorted(index.countries)
+    country_numbers = {name: i for i, name in enumerate(country_names)}
+
+    records = bytearray(RECORD.size * len(rows))
+    names = bytearray()
+    nan = float('nan')
+    for i, row in enumerate(rows):
+        name = row[1].encode('utf-8')
+        RECORD.pack_into(
+            records, i * RECORD.size,
+            row[0], len(names), len(name), tz_numbers[row[2]], country_numbers[row[4]], bool(row[3]),
+            nan if row[5] is None else float(row[5]),
+            nan if row[6] is None else float(row[6])
+        )
+        names += name
+
+    # Списки городов стран делятся между многими ключами — в пул кладём один раз
+    pool = array('I')
+    placed = {}
+
+    def place(members) -> tuple:
+        bounds = placed.get(id(members))
+        if bounds is None:
+            start = len(pool)
+            pool.extend(members)
+            bounds = placed[id(members)] = (start, len(pool))
+        return bounds
+
+    key_ranges = array('I')
+    key_tier = array('B')
+    for tier, members in index._refs:
+        key_tier.append(tier)
+        key_ranges.extend(place(members))
+
+    segments = index._blob.split('\x00') if index._blob else []
+    seg_off = array('I')
+    seg_blob = bytearray()
+    seg_ranges = array('I')
+    for segment, members in zip(segments, index._members):
+        if seg_off:
+            seg_blob += b'\x00'
+        seg_off.append(len(seg_blob))
+        seg_blob += segment.encode('utf-8')
+        seg_ranges.extend(place(members))
+
+    co_order = array('I')
+    co_ranges = array('I')
+    for name in country_names:
+        co_ranges.append(len(co_order))
+        co_order.extend(index.countries[name])
+        co_ranges.append(len(co_order))
+
+    by_id = sorted((row[0], i) for i, row in enumerate(rows))
+    tree = NearbyTree(rows)
+    tz_off, tz_blob = _strings(timezones)
+    co_off, co_blob = _strings(country_names)
+    key_off, key_blob = _strings(index._keys)
+
+    return {
+        'meta': json.dumps({
+            'schema': schema, 'cities': len(rows), 'capitals': index.capitals, 'built_at': int(time.time())
+        }).encode('utf-8'),
+        'records': bytes(records),
+        'names': bytes(names),
+        'tz_off': tz_off,
+        'tz_blob': tz_blob,
+        'co_off': co_off,
+        'co_blob': co_blob,
+        'co_ranges': co_ranges.tobytes(),
+        'co_order': co_order.tobytes(),
+        'ids': array('q', [city_id for city_id, _ in by_id]).tobytes(),
+        'id_rows': array('I', [i for _, i in by_id]).tobytes(),
+        'key_off': key_off,
+        'key_blob': key_blob,
+        'key_tier': key_tier.tobytes(),
+        'key_ranges': key_ranges.tobytes(),
+        'seg_off': seg_off.tobytes(),
+        'seg_blob': bytes(seg_blob),
+        'seg_ranges': seg_ranges.tobytes(),
+        'pool': pool.tobytes(),
+        'tree_x': array('d', tree.coords[0]).tobytes(),
+        'tree_y': array('d', tree.coords[1]).tobytes(),
+        'tree_z': array('d', tree.coords[2]).tobytes(),
+        'tree_axes': array('B', tree.axes).tobytes(),
+        'tree_order': array('I', tree.order).tobytes()
+    }
+
+
+def write_snapshot(path: str, version: int, sections: dict) -> int:
+    '''Пишет снимок атомарно (через временный файл); размер в байтах'''
+    offset = HEADER.size + SECTION.size * len(sections)
+    layout = []
+    for name, data in sections.items():
+        offset += -offset % ALIGN
+        layout.append((name, offset, data))
+        offset += len(data)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, version, len(sections)))
+        for name, start, data in layout:
+            f.write(SECTION.pack(name.encode('ascii'), start, len(data)))
+        for _, start, data in layout:
+            f.write(b'\x00' * (start - f.tell()))
+            f.write(data)
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def publish(conn, schema: str, path: str, version: int):
+    '''Кладёт файл снимка в catalog_snapshot, откуда его скачивают функции'''
+    import psycopg2
+    with open(path, 'rb') as f:
+        data = f.read()
+    cur = conn.cursor()
+    cur.execute(
+        f"INSERT INTO {schema}.catalog_snapshot (id, version, data, built_at) "
+        f"VALUES (1, %s, %s, CURRENT_TIMESTAMP) "
+        f"ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, data = EXCLUDED.data, "
+        f"built_at = EXCLUDED.built_at",
+        (version, psycopg2.Binary(data))
+    )
+    conn.commit()
+    cur.close()
+
+
+def build(conn, schema: str, path: str = None, publish_to_db: bool = True) -> dict:
+    '''Собирает снимок текущей версии справочника в path (по умолчанию — во временном
+    каталоге) и публикует его в catalog_snapshot'''
+    from autocomplete import _load
+
+    path = path or os.path.join(tempfile.gettempdir(), f'catalog-{schema}-build.snapshot')
+    started = time.monotonic()
+    cur = conn.cursor()
+    # Версия и строки из одного снимка БД
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    cur.execute(f"SELECT version FROM {schema}.catalog_version WHERE id = 1")
+    row = cur.fetchone()
+    if not row:
+        raise SnapshotError('Нет строки catalog_version: примените миграции')
+    index = _load(cur, schema, row[0])
+    cur.close()
+    conn.rollback()
+
+    size = write_snapshot(path, index.version, compile_index(index, schema))
+    if publish_to_db:
+        publish(conn, schema, path, index.version)
+    return {
+        'path': path,
+        'version': index.version,
+        'cities': len(index.rows),
+        'bytes': size,
+        'published': publish_to_db,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='по умолчанию — файл во временном каталоге')
+    parser.add_argument('--no-publish', action='store_true', help='не класть снимок в catalog_snapshot')
+    args = parser.parse_args()
+
+    import db
+    conn = db.get_conn()
+    try:
+        stats = build(conn, os.environ['MAIN_DB_SCHEMA'], args.output, not args.no_publish)
+    finally:
+        db.put_conn(conn)
+    print(json.dumps({'catalog_snapshot': stats}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''Таблицы переходов часовых поясов, построенные из zoneinfo один раз на процесс.
+
+Для каждого пояса хранятся моменты смены смещения (UTC, секунды) и
+параметры каждого отрезка: смещение, аббревиатура, признак летнего
+времени. Текущие данные для города — бинарный поиск по массиву, без
+вычислений zoneinfo на каждый запрос.
+
+В кэше процесса таблица пояса покрывает фиксированное окно вокруг
+текущего момента; для моментов вне него таблица строится на один запрос
+и не кэшируется, поэтому запрос с далёкой датой не раздувает общие
+таблицы и не держит блокировку. Кэшируются только пояса из
+available_timezones().
+'''
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+# Окно кэша: столько дней до и после текущего момента
+TABLE_DAYS = int(os.environ.get('TZ_TABLE_DAYS', '400'))
+TABLE_PAST_DAYS = int(os.environ.get('TZ_TABLE_PAST_DAYS', '400'))
+DAY = 86400
+
+
+class TransitionTable:
+    def __init__(self, tz_name: str, start: int, end: int):
+        self.tz_name = tz_name
+        self.start = start
+        self.end = end
+        # Массивы numpy для convert.py: живут и вытесняются вместе с таблицей
+        self.arrays = None
+        zone = ZoneInfo(tz_name)
+
+        def info(ts: int) -> tuple:
+            dt = datetime.fromtimestamp(ts, zone)
+            return int(dt.utcoffset().total_seconds()), dt.tzname(), bool(dt.dst())
+
+        current = info(start)
+        self.starts = [start]
+        self.infos = [current]
+        t = start
+        while t < end:
+            nt = min(t + DAY, end)
+            if info(nt) == current:
+                t = nt
+                continue
+            # Смена внутри суток: уточняем момент до секунды
+            lo, hi = t, nt
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if info(mid) == current:
+                    lo = mid
+                else:
+                    hi = mid
+            current = info(hi)
+            self.starts.append(hi)
+            self.infos.append(current)
+            t = hi
+
+    def covers(self, ts: float) -> bool:
+        return self.start <= ts < self.end
+
+    def lookup(self, ts: float) -> tuple:
+        '''(смещение, аббревиатура, летнее время, следующий переход или None)'''
+        i = bisect_right(self.starts, ts) - 1
+        offset, abbr, is_dst = self.infos[i]
+        next_transition = self.starts[i + 1] if i + 1 < len(self.starts) else None
+        return offset, abbr, is_dst, next_transition
+
+
+_tables = {}
+_lock = threading.Lock()
+_zones = None
+
+
+def known_zone(tz_name) -> bool:
+    global _zones
+    if _zones is None:
+        _zones = frozenset(available_timezones())
+    return isinstance(tz_name, str) and tz_name in _zones
+
+
+def _build(tz_name: str, start: int, end: int):
+    try:
+        return TransitionTable(tz_name, start, end)
+    except (ZoneInfoNotFoundError, ValueError, OverflowError, OSError):
+        return None
+
+
+def get_table(tz_name: str, ts: float = None, until: float = None):
+    '''Таблица пояса, покрывающая моменты с ts по until; None для неизвестного пояса.
+    Окно кэша сдвигается вслед за текущим временем; вне его — таблица на один запрос.'''
+    if not known_zone(tz_name):
+        return None
+    now = time.time()
+    ts = now if ts is None else ts
+    until = ts if until is None else until
+    table = _tables.get(tz_name)
+    if table is not None and table.covers(ts) and table.covers(until):
+        return table
+    start = int(now) - TABLE_PAST_DAYS * DAY
+    end = int(now) + TABLE_DAYS * DAY
+    if not (start <= ts and until < end):
+        return _build(tz_name, int(ts) - DAY, int(until) + DAY)
+    with _lock:
+        table = _tables.get(tz_name)
+        if table is None or not (table.covers(ts) and table.covers(until)):
+            table = _build(tz_name, start, end)
+            _tables[tz_name] = table
+    return table
+
+
+def format_offset(offset: int) -> str:
+    sign = '+' if offset >= 0 else '-'
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return f'{sign}{hours:02d}:{minutes:02d}'
+
+
+def time_info(tz_name: str, ts: float) -> dict:
+    table = get_table(tz_name, ts)
+    if table is None:
+        return {'utc_offset': None, 'utc_offset_str': None, 'abbreviation': None,
+                'is_dst': None, 'next_transition': None}
+    offset, abbr, is_dst, next_transition = table.lookup(ts)
+    return {
+        'utc_offset': offset,
+        'utc_offset_str': format_offset(offset),
+        'abbreviation': abbr,
+        'is_dst': is_dst,
+        'next_transition': (
+            datetime.fromtimestamp(next_transition, timezone.utc).isoformat().replace('+00:00', 'Z')
+            if next_transition is not None else None
+        )
+    }
+
+
+def annotate(cities: list, ts: float = None) -> float:
+    '''Дописывает городам поля времени; пояс считается один раз на ответ.
+    Возвращает момент, на который посчитано (секунды UTC).'''
+    ts = time.time() if ts is None else ts
+    by_zone = {}
+    for city in cities:
+        tz_name = city['timezone']
+        if tz_name not in by_zone:
+            by_zone[tz_name] = time_info(tz_name, ts)
+        city.update(by_zone[tz_name])
+    return ts
@@ -1,121 +1,106 @@
-import json
-import os
-import psycopg2
+import sessions
+import store
+from responses import json_response, not_modified, make_etag, PRIVATE_REVALIDATE
+from runtime import HTTPError, Router, warm_db
 
-def handler(event: dict, context) -> dict:
-    '''API для управления настройками пользователя'''
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+def settings_etag(user_id: int, version) -> str:
+    return make_etag('settings', user_id, version)
+
+def require_token(req) -> str:
+    token = req.token
+    if not token:
+        raise HTTPError(401, 'Токен не предоставлен')
+    return token
+
+def settings_response(req, user_id: int, version: int, settings: dict) -> dict:
+    return json_response(
+        dict(settings, version=version), req.event,
+        cache_control=PRIVATE_REVALIDATE, etag=settings_etag(user_id, version)
+    )
+
+def expected_version(body: dict):
+    version = body.get('version')
+    if version is None:
+        return None
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+        raise HTTPError(400, 'version должна быть неотрицательным целым')
+    return version
+
+def save(req, changes: dict, version: int = None, tests: dict = None) -> dict:
+    '''Условная или безусловная запись; при конфликте — 409 с текущими настройками'''
+    cur = req.conn.cursor()
+    user_id = req.user_id(cur)
+    try:
+        version, settings = store.write(cur, req.schema, user_id, changes, version, tests)
+    except store.SettingsConflict as e:
+        req.conn.rollback()
+        cur.close()
+        return json_response({'error': str(e), 'version': e.version, 'settings': e.settings}, status=409)
+    req.conn.commit()
+    cur.close()
+    store.remember(user_id, version, settings)
     
-    token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
+    return json_response({'success': True, 'version': version, 'settings': settings})
+
+router = Router(allow_headers='Content-Type, X-Authorization')
+
+def min_version(params: dict) -> int:
+    '''Версия, которую клиент уже видел (?min_version=): читать более старую нельзя'''
+    try:
+        return max(0, int(params.get('min_version') or 0))
+    except ValueError:
+        raise HTTPError(400, 'min_version должна быть целым числом')
+
+@router.route('GET', read_only=True)
+def get_settings(req) -> dict:
+    seen = min_version(req.params)
+    # Пользователь и настройки в памяти — ответ или 304 без БД
+    user_id = sessions.cached_user(require_token(req))
+    if user_id is not None:
+        version, settings = store.cached(user_id)
+        if version is not None and version >= seen:
+            cached = not_modified(req.event, settings_etag(user_id, version), PRIVATE_REVALIDATE)
+            if cached is not None:
+                return cached
+            if settings is not None:
+                return settings_response(req, user_id, version, settings)
     
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен не предоставлен'}),
-            'isBase64Encoded': False
-        }
+    cur = req.conn.cursor()
+    user_id = req.user_id(cur)
+    version, settings = store.read(cur, req.schema, user_id)
+    cur.close()
+    if version < seen:
+        # Реплика ещё не получила запись, ответ на которую клиент уже видел
+        req.require_primary()
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    schema = os.environ['MAIN_DB_SCHEMA']
+    return settings_response(req, user_id, version, settings)
+
+@router.route('PUT')
+def update_settings(req) -> dict:
+    '''Частичное обновление полями тела; с "version" — только если версия не изменилась'''
+    require_token(req)
+    body = req.body
+    try:
+        changes = store.validate(body)
+    except store.SettingsError as e:
+        raise HTTPError(400, str(e))
     
+    return save(req, changes, expected_version(body))
+
+@router.route('PATCH')
+def patch_settings(req) -> dict:
+    '''Пачка операций {"version": 7, "ops": [{"op": "replace", "path": "/theme", "value": "dark"}]}'''
+    require_token(req)
+    body = req.body
     try:
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT user_id FROM {schema}.sessions WHERE token = %s AND expires_at > NOW()",
-            (token,)
-        )
-        result = cur.fetchone()
-        
-        if not result:
-            cur.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Недействительный токен'}),
-                'isBase64Encoded': False
-            }
-        
-        user_id = result[0]
-        
-        if method == 'GET':
-            cur.execute(
-                f"SELECT theme, weather_city, timezone_mode, notifications_enabled "
-                f"FROM {schema}.user_settings WHERE user_id = %s",
-                (user_id,)
-            )
-            settings = cur.fetchone()
-            cur.close()
-            
-            if not settings:
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'theme': 'white',
-                        'weather_city': 'Москва',
-                        'timezone_mode': '24',
-                        'notifications_enabled': True
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'theme': settings[0],
-                    'weather_city': settings[1],
-                    'timezone_mode': settings[2],
-                    'notifications_enabled': settings[3]
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            theme = body.get('theme')
-            weather_city = body.get('weather_city')
-            timezone_mode = body.get('timezone_mode')
-            notifications_enabled = body.get('notifications_enabled')
-            
-            cur.execute(
-                f"UPDATE {schema}.user_settings "
-                f"SET theme = COALESCE(%s, theme), "
-                f"weather_city = COALESCE(%s, weather_city), "
-                f"timezone_mode = COALESCE(%s, timezone_mode), "
-                f"notifications_enabled = COALESCE(%s, notifications_enabled) "
-                f"WHERE user_id = %s",
-                (theme, weather_city, timezone_mode, notifications_enabled, user_id)
-            )
-            conn.commit()
-            cur.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        changes, tests = store.parse_patch(body.get('ops'))
+    except store.SettingsError as e:
+        raise HTTPError(400, str(e))
     
-    finally:
-        conn.close()
+    return save(req, changes, expected_version(body), tests)
+
+router.warmup(warm_db)
+
+def handler(event: dict, context) -> dict:
+    '''API для управления настройками пользователя'''
+    return router(event, context)
@@ -0,0 +1,162 @@
+'''Версионированное хранилище настроек пользователя.
+
+Каждая запись увеличивает user_settings.version на единицу. Запись с
+ожидаемой версией — compare-and-set: UPDATE ... WHERE version = %s, и если
+строку успели изменить, вызывающий получает SettingsConflict с текущими
+настройками вместо тихой перезаписи. Пачка изменений (PATCH в стиле JSON
+Patch: replace/test) применяется одним UPDATE, поэтому серия
+переключателей клиента становится одной записью.
+
+Прочитанные и записанные настройки кэшируются в памяти по user_id вместе
+с версией не дольше SETTINGS_VERSION_TTL секунд: изменения с других
+экземпляров видны не позже TTL, свои — сразу.
+'''
+import os
+import threading
+import time
+
+VERSION_TTL = float(os.environ.get('SETTINGS_VERSION_TTL', '30'))
+CACHE_SIZE = int(os.environ.get('SETTINGS_CACHE_SIZE', '10000'))
+
+FIELDS = ('theme', 'weather_city', 'timezone_mode', 'notifications_enabled')
+DEFAULTS = {
+    'theme': 'white',
+    'weather_city': 'Москва',
+    'timezone_mode': '24',
+    'notifications_enabled': True
+}
+MAX_LENGTH = {'theme': 50, 'weather_city': 100, 'timezone_mode': 20}
+COLUMNS = ', '.join(FIELDS) + ', version'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class SettingsError(ValueError):
+    '''Некорректное изменение настроек'''
+
+
+class SettingsConflict(Exception):
+    '''Версия или проверки в запросе устарели; version и settings — состояние на сервере'''
+
+    def __init__(self, version: int, settings: dict):
+        super().__init__(f'Настройки изменены, текущая версия {version}')
+        self.version = version
+        self.settings = settings
+
+
+def remember(user_id: int, version: int, settings: dict = None):
+    '''Версия (и, если известны, сами настройки) пользователя на VERSION_TTL'''
+    with _cache_lock:
+        if len(_cache) >= CACHE_SIZE and user_id not in _cache:
+            _cache.pop(next(iter(_cache)))
+        _cache[user_id] = (version, settings, time.monotonic() + VERSION_TTL)
+
+
+def cached(user_id: int) -> tuple:
+    '''(версия, настройки или None) из памяти; (None, None) при промахе'''
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None, None
+        if entry[2] <= time.monotonic():
+            del _cache[user_id]
+            return None, None
+        return entry[0], entry[1]
+
+
+def _row_to_settings(row) -> dict:
+    return dict(zip(FIELDS, row[:len(FIELDS)]))
+
+
+def read(cur, schema: str, user_id: int) -> tuple:
+    '''(версия, настройки) из БД; без строки настроек — (0, DEFAULTS)'''
+    cur.execute(f"SELECT {COLUMNS} FROM {schema}.user_settings WHERE user_id = %s", (user_id,))
+    row = cur.fetchone()
+    if not row:
+        return 0, dict(DEFAULTS)
+    settings = _row_to_settings(row)
+    remember(user_id, row[-1], settings)
+    return row[-1], settings
+
+
+def validate(changes: dict) -> dict:
+    '''Оставляет известные поля и проверяет их типы'''
+    result = {}
+    for field, value in changes.items():
+        if field not in FIELDS or value is None:
+            continue
+        if field == 'notifications_enabled':
+            if not isinstance(value, bool):
+                raise SettingsError(f'{field}: ожидается true или false')
+        elif not isinstance(value, str) or not value or len(value) > MAX_LENGTH[field]:
+            raise SettingsError(f'{field}: ожидается строка до {MAX_LENGTH[field]} символов')
+        result[field] = value
+    return result
+
+
+def parse_patch(ops) -> tuple:
+    '''Операции [{"op": "replace"|"test", "path": "/theme", "value": ...}] → (изменения, проверки)'''
+    if not isinstance(ops, list) or not ops:
+        raise SettingsError('ops: ожидается непустой список операций')
+    changes, tests = {}, {}
+    for op in ops:
+        if not isinstance(op, dict) or op.get('op') not in ('replace', 'test'):
+            raise SettingsError('Поддерживаются только операции replace и test')
+        field = str(op.get('path', '')).lstrip('/')
+        if field not in FIELDS or 'value' not in op:
+            raise SettingsError(f'Неизвестное поле {field or op.get("path")}')
+        target = changes if op['op'] == 'replace' else tests
+        target.update(validate({field: op['value']}))
+    return changes, tests
+
+
+def _check(version: int, settings: dict, expected_version: int, tests: dict):
+    if expected_version is not None and expected_version != version:
+        raise SettingsConflict(version, settings)
+    if any(settings.get(field) != value for field, value in tests.items()):
+        raise SettingsConflict(version, settings)
+
+
+def write(cur, schema: str, user_id: int, changes: dict, expected_version: int = None,
+          tests: dict = None) -> tuple:
+    '''Применяет изменения одной записью; (новая версия, настройки)
+
+    С expected_version или tests запись условная: если версия или значения
+    полей не совпали, поднимается SettingsConflict с текущим состоянием.
+    Версия 0 означает «строки настроек ещё нет». В кэш результат кладёт
+    вызывающий после коммита — remember().
+    '''
+    tests = tests or {}
+    if not changes:
+        version, settings = read(cur, schema, user_id)
+        _check(version, settings, expected_version, tests)
+        return version, settings
+
+    assignments = ''.join(f'{field} = %s, ' for field in changes)
+    conditions = ''.join(f' AND {field} = %s' for field in tests)
+    if expected_version is not None:
+        conditions += ' AND version = %s'
+    params = [*changes.values(), user_id, *tests.values()]
+
+    for _ in range(2):
+        cur.execute(
+            f"UPDATE {schema}.user_settings SET {assignments}version = version + 1 "
+            f"WHERE user_id = %s{conditions} RETURNING {COLUMNS}",
+            params + ([expected_version] if expected_version is not None else [])
+        )
+        row = cur.fetchone()
+        if row:
+            return row[-1], _row_to_settings(row)
+        version, settings = read(cur, schema, user_id)
+        if version:
+            raise SettingsConflict(version, settings)
+        # Строки ещё нет (пользователь старше таблицы настроек): создаём с версией 1 и повторяем
+        cur.execute(
+            f"INSERT INTO {schema}.user_settings (user_id) VALUES (%s) ON CONFLICT (user_id) DO NOTHING",
+            (user_id,)
+        )
+        if expected_version is not None:
+            _check(0, settings, expected_version, tests)
+            expected_version = 1
+    raise SettingsConflict(*read(cur, schema, user_id))
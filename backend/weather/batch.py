@@ -0,0 +1,145 @@
+'''Пакетный запрос погоды: параллельно по городам, с общим дедлайном'''
+import os
+import threading
+
+MAX_CITIES = int(os.environ.get('WEATHER_BATCH_MAX', '50'))
+DEADLINE = float(os.environ.get('WEATHER_BATCH_DEADLINE', '4'))
+WORKERS = int(os.environ.get('WEATHER_BATCH_WORKERS', '8'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _split(value) -> list:
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(',') if part.strip()]
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise BatchError('cities и city_ids — строка через запятую или список')
+    return value
+
+
+def parse_request(params: dict, body: dict) -> tuple:
+    '''Из ?cities=/?city_ids= или тела POST достаёт (названия, id городов)'''
+    names = _split(body.get('cities') or params.get('cities'))
+    if not all(isinstance(name, str) and name.strip() for name in names):
+        raise BatchError('Названия городов должны быть непустыми строками')
+    try:
+        ids = [int(v) for v in _split(body.get('city_ids') or params.get('city_ids'))]
+    except (TypeError, ValueError):
+        raise BatchError('city_ids должны быть числами')
+    if not names and not ids:
+        raise BatchError('Не указаны города')
+    if len(names) + len(ids) > MAX_CITIES:
+        raise BatchError(f'Не больше {MAX_CITIES} городов за запрос')
+    return names, ids
+
+
+def load_targets(ids: list, schema: str) -> list:
+    '''Города по id с координатами: по ним OpenWeatherMap ищет точнее, чем по названию'''
+    import db
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT id, name, latitude, longitude FROM {schema}.cities WHERE id = ANY(%s)",
+            (ids,)
+        )
+        found = {row[0]: row for row in cur.fetchall()}
+        cur.close()
+        conn.rollback()
+    finally:
+        db.put_conn(conn)
+
+    targets = []
+    for city_id in ids:
+        row = found.get(city_id)
+        if row is None:
+            targets.append({'id': city_id, 'city': None})
+            continue
+        targets.append({
+            'id': city_id,
+            'city': row[1],
+            'lat': float(row[2]) if row[2] is not None else None,
+            'lon': float(row[3]) if row[3] is not None else None
+        })
+    return targets
+
+
+def cache_key(target: dict) -> str:
+    '''Ключ кэша: по координатам для городов из справочника — одноимённых городов много'''
+    if target.get('lat') is not None and target.get('lon') is not None:
+        return f"@{target['lat']:.2f},{target['lon']:.2f}"
+    return target['city']
+
+
+def get_executor():
+    '''Общий пул потоков; concurrent.futures импортируется только для пакетных запросов'''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='weather')
+    return _executor
+
+
+def _result(target: dict) -> dict:
+    result = {'city': target['city']}
+    if target.get('id') is not None:
+        result['id'] = target['id']
+    return result
+
+
+def _done(target: dict, data: dict, cache_status: str) -> dict:
+    result = _result(target)
+    result.update(data)
+    result['status'] = 'ok'
+    result['cache'] = cache_status
+    return result
+
+
+def fetch_batch(targets: list, fetch, deadline: float = DEADLINE, peek=None) -> list:
+    '''fetch(target) -> (данные, статус кэша). Результаты — в порядке targets.
+
+    peek(targets) -> [(данные, статус кэша) или None] отдаёт попадания в кэш
+    прямо в потоке запроса; в пул уходят только промахи. Города, не
+    успевшие к дедлайну, помечаются timeout: ещё не начатые задачи
+    отменяются, чтобы не занимать пул следующих запросов, начатые
+    доходят до конца и кладут погоду в кэш.
+    '''
+    from concurrent.futures import wait
+
+    results = [None] * len(targets)
+    cached = peek(targets) if peek else [None] * len(targets)
+    futures = {}
+    executor = None
+    for i, target in enumerate(targets):
+        if target['city'] is None:
+            results[i] = {'id': target['id'], 'status': 'not_found'}
+        elif cached[i] is not None:
+            results[i] = _done(target, *cached[i])
+        else:
+            executor = executor or get_executor()
+            futures[executor.submit(fetch, target)] = i
+
+    if futures:
+        wait(futures, timeout=deadline)
+
+    for future, i in futures.items():
+        result = _result(targets[i])
+        if not future.done():
+            future.cancel()
+            result['status'] = 'timeout'
+        elif future.exception() is not None:
+            result['status'] = 'error'
+            result['error'] = str(future.exception())
+        else:
+            result = _done(targets[i], *future.result())
+        results[i] = result
+    return results
@@ -0,0 +1,233 @@
+'''Кэш погоды с TTL и stale-while-revalidate.
+
+Ключ — нормализованное название города. Свежая запись отдаётся сразу;
+устаревшая (в пределах окна stale) тоже отдаётся сразу, а обновление
+уходит в фоновый поток. Одновременные промахи по одному городу
+схлопываются в один запрос к OpenWeatherMap.
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TTL = float(os.environ.get('WEATHER_CACHE_TTL', '600'))
+STALE = float(os.environ.get('WEATHER_CACHE_STALE', '1800'))
+MAX_ENTRIES = int(os.environ.get('WEATHER_CACHE_MAX_ENTRIES', '1000'))
+BACKEND = os.environ.get('WEATHER_CACHE_BACKEND', 'memory')
+# Дольше таймаута запроса к OpenWeatherMap ведомые ждать не должны
+FLIGHT_WAIT = float(os.environ.get('WEATHER_CACHE_FLIGHT_WAIT', '6'))
+
+HIT = 'HIT'
+STALE_HIT = 'STALE'
+MISS = 'MISS'
+
+
+def normalize_city(city: str) -> str:
+    return ' '.join(city.lower().replace('ё', 'е').split())
+
+
+class MemoryBackend:
+    '''LRU в памяти процесса, живёт между тёплыми вызовами'''
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        payload, stored_at = entry
+        return payload, time.time() - stored_at
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                found[key] = entry
+        return found
+
+    def set(self, key: str, payload: dict):
+        with self._lock:
+            self._entries[key] = (payload, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class PostgresBackend:
+    '''Таблица weather_cache: одна запись на город для всех экземпляров'''
+
+    def __init__(self, schema: str):
+        import db
+        self.db = db
+        self.schema = schema
+
+    def get(self, key: str):
+        conn = self.db.get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT payload, EXTRACT(EPOCH FROM NOW() - fetched_at) "
+                f"FROM {self.schema}.weather_cache WHERE city_key = %s",
+                (key,)
+            )
+            row = cur.fetchone()
+            cur.close()
+            conn.rollback()
+        finally:
+            self.db.put_conn(conn)
+        if not row:
+            return None
+        return json.loads(row[0]), float(row[1])
+
+    def get_many(self, keys: list) -> dict:
+        '''Записи нескольких городов одним запросом'''
+        conn = self.db.get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT city_key, payload, EXTRACT(EPOCH FROM NOW() - fetched_at) "
+                f"FROM {self.schema}.weather_cache WHERE city_key = ANY(%s)",
+                (list(keys),)
+            )
+            rows = cur.fetchall()
+            cur.close()
+            conn.rollback()
+        finally:
+            self.db.put_conn(conn)
+        return {key: (json.loads(payload), float(age)) for key, payload, age in rows}
+
+    def set(self, key: str, payload: dict):
+        conn = self.db.get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"INSERT INTO {self.schema}.weather_cache (city_key, payload, fetched_at) "
+                f"VALUES (%s, %s, NOW()) "
+                f"ON CONFLICT (city_key) DO UPDATE SET payload = EXCLUDED.payload, fetched_at = EXCLUDED.fetched_at",
+                (key, json.dumps(payload))
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            self.db.put_conn(conn)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WeatherCache:
+    def __init__(self, backend, ttl: float = TTL, stale: float = STALE):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, city: str, fetch) -> tuple:
+        '''Возвращает (данные, HIT|STALE|MISS); fetch() ходит в OpenWeatherMap'''
+        payload, status, _ = self.get_with_age(city, fetch)
+        return payload, status
+
+    def get_with_age(self, city: str, fetch) -> tuple:
+        '''Как get(), плюс возраст отданных данных в секундах'''
+        key = normalize_city(city)
+        entry = self.backend.get(key)
+        if entry is not None:
+            payload, age = entry
+            if age < self.ttl:
+                return payload, HIT, age
+            if age < self.ttl + self.stale:
+                self._revalidate(key, fetch)
+                return payload, STALE_HIT, age
+        try:
+            return self._fetch(key, fetch), MISS, 0.0
+        except Exception:
+            # Лучше сильно устаревшие данные, чем заглушка
+            if entry is not None:
+                return entry[0], STALE_HIT, entry[1]
+            raise
+
+    def peek_many(self, fetches: dict) -> dict:
+        '''{город: fetch} → {город: (данные, HIT|STALE)} только для найденных в кэше;
+        в OpenWeatherMap не ходит, устаревшие записи обновляются в фоне'''
+        keys = {city: normalize_city(city) for city in fetches}
+        entries = self.backend.get_many(list(set(keys.values())))
+        found = {}
+        for city, key in keys.items():
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            payload, age = entry
+            if age < self.ttl:
+                found[city] = payload, HIT
+            elif age < self.ttl + self.stale:
+                self._revalidate(key, fetches[city])
+                found[city] = payload, STALE_HIT
+        return found
+
+    def _fetch(self, key: str, fetch) -> dict:
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(FLIGHT_WAIT):
+                raise TimeoutError('Превышено время ожидания ответа погоды')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fetch()
+            self.backend.set(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _revalidate(self, key: str, fetch):
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def run():
+            try:
+                self._fetch(key, fetch)
+            except Exception:
+                pass
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> WeatherCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if BACKEND == 'postgres':
+                    backend = PostgresBackend(os.environ['MAIN_DB_SCHEMA'])
+                else:
+                    backend = MemoryBackend()
+                _cache = WeatherCache(backend)
+    return _cache
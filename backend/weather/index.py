@@ -1,97 +1,133 @@
-import json
 import os
-import urllib.request
-from urllib.parse import urlencode
+import instrument
+from cache import get_cache, TTL, STALE, BACKEND
+from responses import json_response, make_etag, loads, NO_STORE
+from runtime import HTTPError, Router, warm_db
+from batch import parse_request, load_targets, fetch_batch, get_executor, cache_key, BatchError
 
-def handler(event: dict, context) -> dict:
-    '''API для получения данных о погоде из OpenWeatherMap'''
-    method = event.get('httpMethod', 'GET')
+OPENWEATHER_URL = os.environ.get('OPENWEATHER_URL', 'https://api.openweathermap.org')
+
+CONDITION_MAP = {
+    'Clear': 'Ясно',
+    'Clouds': 'Облачно',
+    'Rain': 'Дождь',
+    'Snow': 'Снег',
+    'Thunderstorm': 'Гроза',
+    'Drizzle': 'Морось',
+    'Mist': 'Туман',
+    'Fog': 'Туман'
+}
+
+def fetch_weather(api_key: str, city: str, lat: float = None, lon: float = None) -> dict:
+    # HTTP-клиент нужен только на промахе кэша
+    import urllib.request
+    from urllib.parse import urlencode
+    
+    weather_params = {
+        'appid': api_key,
+        'units': 'metric',
+        'lang': 'ru'
+    }
+    if lat is not None and lon is not None:
+        weather_params['lat'] = lat
+        weather_params['lon'] = lon
+    else:
+        weather_params['q'] = city
+    
+    url = f'{OPENWEATHER_URL}/data/2.5/weather?{urlencode(weather_params)}'
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    with instrument.span('upstream'), urllib.request.urlopen(url, timeout=5) as response:
+        data = loads(response.read())
+    
+    temp = round(data['main']['temp'])
+    condition = data['weather'][0]['main']
+    
+    return {
+        'temp': f'{temp}°C',
+        'condition': CONDITION_MAP.get(condition, condition),
+        'description': data['weather'][0]['description'].capitalize(),
+        'humidity': data['main']['humidity'],
+        'wind_speed': data['wind']['speed']
+    }
+
+router = Router()
+
+@router.route('GET', param='cities')
+@router.route('GET', param='city_ids')
+@router.route('POST')
+def batch_handler(req) -> dict:
+    body = req.body if req.method == 'POST' else {}
+    
+    try:
+        names, ids = parse_request(req.params, body)
+    except BatchError as e:
+        raise HTTPError(400, str(e))
     
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+    targets = [{'city': name} for name in names]
+    if ids:
+        targets += load_targets(ids, req.schema)
     
-    params = event.get('queryStringParameters', {})
-    city = params.get('city', 'Москва')
+    api_key = os.environ.get('OPENWEATHER_API_KEY', '')
+    
+    def upstream(target: dict):
+        return lambda: fetch_weather(api_key, target['city'], target.get('lat'), target.get('lon'))
+    
+    def fetch(target: dict) -> tuple:
+        return get_cache().get(cache_key(target), upstream(target))
+    
+    def peek(targets: list) -> list:
+        # Попадания в кэш и заглушка без ключа отдаются сразу, без очереди пула
+        if not api_key:
+            stub = {'temp': '22°C', 'condition': 'Ясно', 'description': 'API ключ не настроен'}, 'NONE'
+            return [stub] * len(targets)
+        fetches = {cache_key(t): upstream(t) for t in targets if t['city'] is not None}
+        found = get_cache().peek_many(fetches)
+        return [found.get(cache_key(t)) if t['city'] is not None else None for t in targets]
+    
+    # Промахи идут в потоках пула: фаза upstream — общее время ожидания пачки
+    with instrument.span('upstream'):
+        result = {'weather': fetch_batch(targets, fetch, peek=peek)}
+    return json_response(result, req.event, cache_control='no-cache', etag=make_etag(result))
+
+@router.route('GET')
+def weather_handler(req) -> dict:
+    city = req.params.get('city', 'Москва')
     api_key = os.environ.get('OPENWEATHER_API_KEY', '')
     
     if not api_key:
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'temp': '22°C',
-                'condition': 'Ясно',
-                'description': 'API ключ не настроен'
-            }),
-            'isBase64Encoded': False
-        }
+        return json_response({
+            'temp': '22°C',
+            'condition': 'Ясно',
+            'description': 'API ключ не настроен'
+        }, cache_control=NO_STORE)
     
     try:
-        weather_params = {
-            'q': city,
-            'appid': api_key,
-            'units': 'metric',
-            'lang': 'ru'
-        }
+        data, cache_status, age = get_cache().get_with_age(city, lambda: fetch_weather(api_key, city))
         
-        url = f'https://api.openweathermap.org/data/2.5/weather?{urlencode(weather_params)}'
-        
-        with urllib.request.urlopen(url, timeout=5) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            
-            temp = round(data['main']['temp'])
-            condition = data['weather'][0]['main']
-            description = data['weather'][0]['description'].capitalize()
-            
-            condition_map = {
-                'Clear': 'Ясно',
-                'Clouds': 'Облачно',
-                'Rain': 'Дождь',
-                'Snow': 'Снег',
-                'Thunderstorm': 'Гроза',
-                'Drizzle': 'Морось',
-                'Mist': 'Туман',
-                'Fog': 'Туман'
-            }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'temp': f'{temp}°C',
-                    'condition': condition_map.get(condition, condition),
-                    'description': description,
-                    'humidity': data['main']['humidity'],
-                    'wind_speed': data['wind']['speed']
-                }),
-                'isBase64Encoded': False
-            }
+        # Браузер держит ответ, пока запись в кэше функции свежая
+        max_age = max(0, int(TTL - age))
+        return json_response(
+            data, req.event,
+            cache_control=f'public, max-age={max_age}, stale-while-revalidate={int(STALE)}',
+            etag=make_etag(data),
+            headers={'X-Cache': cache_status}
+        )
     
     except Exception as e:
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'temp': '22°C',
-                'condition': 'Ясно',
-                'description': f'Ошибка получения данных: {str(e)}'
-            }),
-            'isBase64Encoded': False
-        }
+        return json_response({
+            'temp': '22°C',
+            'condition': 'Ясно',
+            'description': f'Ошибка получения данных: {str(e)}'
+        }, cache_control=NO_STORE)
+
+@router.warmup
+def warm_weather():
+    get_cache()
+    get_executor()
+    import urllib.request  # noqa: F401
+    if BACKEND == 'postgres':
+        warm_db()
+
+def handler(event: dict, context) -> dict:
+    '''API для получения данных о погоде из OpenWeatherMap'''
+    return router(event, context)
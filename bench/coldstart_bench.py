@@ -0,0 +1,151 @@
+'''Бенчмарк холодного старта функций backend.
+
+Запуск из корня репозитория:
+    python bench/coldstart_bench.py [--runs N] [--json] [--save FILE] [--baseline FILE]
+
+Для каждой функции N раз запускается чистый интерпретатор с
+`python -X importtime`: из его вывода берётся время импорта index, затем
+замеряется первый вызов handler() на запросах, которым не нужны БД и сеть
+(OPTIONS и ранние ошибки/заглушки). Печатаются медианы и список тяжёлых
+модулей, оказавшихся загруженными после импорта.
+
+С --baseline сравнивает с сохранённым --save прогоном и завершается с
+кодом 1, если медиана импорта или первого вызова выросла больше чем на
+--max-regression процентов (и больше чем на --min-delta-ms).
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Модули, которых не должно быть после импорта index: их грузят лениво
+HEAVY = ('psycopg2', 'urllib.request', 'secrets', 'orjson', 'brotli', 'gzip', 'hashlib',
+         'concurrent.futures', 'numpy', 'planner', 'convert', 'db')
+
+EVENTS = {
+    'auth': [{'httpMethod': 'OPTIONS'}, {'httpMethod': 'GET'}],
+    'cities': [
+        {'httpMethod': 'OPTIONS'},
+        {'httpMethod': 'POST', 'body': json.dumps({
+            'action': 'plan', 'timezones': ['Europe/Moscow', 'Europe/London'],
+            'date_from': '2026-03-23', 'date_to': '2026-04-03'
+        })}
+    ],
+    'settings': [{'httpMethod': 'OPTIONS'}, {'httpMethod': 'GET'}],
+    'weather': [{'httpMethod': 'OPTIONS'}, {'httpMethod': 'GET', 'queryStringParameters': {'city': 'Москва'}}]
+}
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+loaded = sorted(m for m in {heavy!r} if m in sys.modules)
+calls = []
+for event in {events!r}:
+    t = time.perf_counter()
+    response = index.handler(event, None)
+    calls.append([event['httpMethod'], response['statusCode'], (time.perf_counter() - t) * 1000])
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'calls': calls, 'loaded': loaded}}))
+'''
+
+
+def parse_importtime(stderr: str) -> float:
+    '''Накопленное время импорта index в мс из вывода -X importtime'''
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and line.rstrip().endswith('| index'):
+            return int(line.split('|')[1]) / 1000
+    return None
+
+
+def probe(function: str) -> dict:
+    env = dict(os.environ, MAIN_DB_SCHEMA='bench', OPENWEATHER_API_KEY='', PYTHONDONTWRITEBYTECODE='1')
+    code = PROBE.format(heavy=HEAVY, events=EVENTS[function])
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.join(BACKEND, function), env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'exit %d' % proc.returncode}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['importtime_ms'] = parse_importtime(proc.stderr)
+    return result
+
+
+def run(runs: int) -> dict:
+    results = {}
+    for function in EVENTS:
+        samples = [probe(function) for _ in range(runs)]
+        errors = [s['error'] for s in samples if 'error' in s]
+        if errors:
+            results[function] = {'error': errors[0]}
+            continue
+        first_calls = {}
+        for s in samples:
+            for method, status, ms in s['calls']:
+                first_calls.setdefault(f'{method} {status}', []).append(ms)
+        results[function] = {
+            'import_ms': round(statistics.median(s['importtime_ms'] or s['import_ms'] for s in samples), 3),
+            'first_call_ms': {k: round(statistics.median(v), 3) for k, v in first_calls.items()},
+            'heavy_loaded': samples[0]['loaded']
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, max_regression: float, min_delta: float) -> list:
+    problems = []
+    for function, current in results.items():
+        before = baseline.get(function)
+        if not before or 'error' in before or 'error' in current:
+            continue
+        pairs = [('import', before['import_ms'], current['import_ms'])]
+        for key, ms in current['first_call_ms'].items():
+            if key in before['first_call_ms']:
+                pairs.append((key, before['first_call_ms'][key], ms))
+        for name, old, new in pairs:
+            if new - old > min_delta and new > old * (1 + max_regression / 100):
+                problems.append(f'{function} {name}: {old} → {new} мс')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--save')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, default=25.0)
+    parser.add_argument('--min-delta-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps({'benchmark': 'coldstart', 'results': results}, ensure_ascii=False))
+    else:
+        print(f"{'функция':>9} {'импорт, мс':>11}  первый вызов, мс / тяжёлые модули")
+        for function, r in results.items():
+            if 'error' in r:
+                print(f"{function:>9} {'—':>11}  ошибка: {r['error']}")
+                continue
+            calls = ', '.join(f'{k}: {v}' for k, v in r['first_call_ms'].items())
+            print(f"{function:>9} {r['import_ms']:>11}  {calls} / {', '.join(r['heavy_loaded']) or '—'}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.max_regression, args.min_delta_ms)
+        for problem in problems:
+            print('регрессия:', problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+'''Нагрузочный бенчмарк функций backend на локальной БД и заглушках внешних API.
+
+Запуск из корня репозитория:
+    python bench/load_bench.py --dsn postgresql://localhost/bench [--seed-db [--reset]]
+        [--scenarios search_keystrokes,settings_reads] [--requests 2000] [--concurrency 8]
+        [--json] [--save FILE] [--baseline FILE]
+
+БД заполняется bench/seed_db.py (с --seed-db — прямо перед прогоном),
+OpenWeatherMap и Яндекс OAuth подменяет bench/stub_upstream.py. Каждый
+сценарий идёт в отдельном интерпретаторе: у функций одинаковые имена
+модулей (db, responses, runtime), и так же изолированы настоящие инстансы.
+handler() вызывается в процессе из пула потоков; курсоры psycopg2 считают
+выполненные запросы, чтобы показать число обращений к БД на запрос.
+
+Сценарии:
+    search_keystrokes — поиск по справочнику на каждый введённый символ
+    bootstrap         — первый экран авторизованного пользователя
+    settings_reads    — чтение настроек, часть запросов с If-None-Match
+    login_bursts      — волна входов по телефону и через Яндекс
+    weather_polls     — опрос погоды по городу и пачками
+
+С --baseline сравнивает с сохранённым --save прогоном и завершается с
+кодом 1, если p95 вырос или пропускная способность упала больше чем на
+--max-regression процентов.
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCH, '..', 'backend')
+
+SCENARIOS = {
+    'search_keystrokes': 'cities',
+    'bootstrap': 'cities',
+    'settings_reads': 'settings',
+    'login_bursts': 'auth',
+    'weather_polls': 'weather'
+}
+
+
+def percentile(values: list, p: float) -> float:
+    '''Перцентиль по ближайшему рангу'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def auth_headers(user_id: int) -> dict:
+    from seed_db import token_for
+    return {'X-Authorization': f'Bearer {token_for(user_id)}'}
+
+
+def build_events(scenario: str, count: int, names: list, users: int, rng: random.Random) -> list:
+    '''Поток событий сценария длиной count'''
+    from seed_db import WEATHER_CITIES, phone_for
+    events = []
+    while len(events) < count:
+        if scenario == 'search_keystrokes':
+            name = rng.choice(names)
+            for k in range(1, min(len(name), 8) + 1):
+                events.append({'httpMethod': 'GET', 'queryStringParameters': {'search': name[:k]}})
+        elif scenario == 'bootstrap':
+            events.append({'httpMethod': 'GET', 'queryStringParameters': {'bootstrap': '1'},
+                           'headers': auth_headers(rng.randint(1, users))})
+        elif scenario == 'settings_reads':
+            events.append({'httpMethod': 'GET', 'headers': auth_headers(rng.randint(1, users))})
+        elif scenario == 'login_bursts':
+            if rng.random() < 0.1:
+                body = {'action': 'yandex_callback', 'code': f'bench-{rng.randint(1, users)}'}
+            else:
+                body = {'action': 'login', 'phone': phone_for(rng.randint(1, users))}
+            events.append({'httpMethod': 'POST', 'body': json.dumps(body)})
+        elif scenario == 'weather_polls':
+            if rng.random() < 0.2:
+                cities = ','.join(rng.sample(WEATHER_CITIES, 3))
+                events.append({'httpMethod': 'GET', 'queryStringParameters': {'cities': cities}})
+            else:
+                events.append({'httpMethod': 'GET', 'queryStringParameters': {'city': rng.choice(WEATHER_CITIES)}})
+    return events[:count]
+
+
+# --- Исполнитель сценария (дочерний процесс) ---
+
+_local = threading.local()
+
+
+def install_query_counter():
+    '''Подменяет psycopg2.connect так, чтобы курсоры считали запросы в текущем потоке'''
+    import psycopg2
+    import psycopg2.extensions
+
+    class Counting:
+        def execute(self, query, vars=None):
+            _local.queries = getattr(_local, 'queries', 0) + 1
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            _local.queries = getattr(_local, 'queries', 0) + 1
+            return super().executemany(query, vars_list)
+
+    classes = {}
+    connect = psycopg2.connect
+
+    def counting_connect(*args, cursor_factory=None, **kwargs):
+        # Поверх курсора функции (instrument.TracedCursor при TRACE_MODE)
+        base = cursor_factory or psycopg2.extensions.cursor
+        if base not in classes:
+            classes[base] = type('CountingCursor', (Counting, base), {})
+        return connect(*args, cursor_factory=classes[base], **kwargs)
+
+    psycopg2.connect = counting_connect
+
+
+def worker(config: dict) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    function_dir = os.path.join(BACKEND, config['function'])
+    sys.path.insert(0, function_dir)
+    os.chdir(function_dir)
+    install_query_counter()
+
+    started = time.perf_counter()
+    import index
+    import_ms = (time.perf_counter() - started) * 1000
+
+    etags = {}
+    etags_lock = threading.Lock()
+    revalidate = config['revalidate']
+    rng = random.Random(config['seed'])
+
+    def call(event: dict) -> tuple:
+        key = json.dumps([event.get('queryStringParameters'), event.get('headers')], sort_keys=True)
+        with etags_lock:
+            etag = etags.get(key) if rng.random() < revalidate else None
+        if etag:
+            event = dict(event, headers=dict(event.get('headers') or {}, **{'If-None-Match': etag}))
+        _local.queries = 0
+        t = time.perf_counter()
+        try:
+            response = index.handler(event, None)
+            status = response['statusCode']
+        except Exception as e:
+            response, status = {}, type(e).__name__
+        elapsed = (time.perf_counter() - t) * 1000
+        new_etag = (response.get('headers') or {}).get('ETag')
+        if new_etag:
+            with etags_lock:
+                etags[key] = new_etag
+        return status, elapsed, _local.queries
+
+    events = config['events']
+    cold_status, cold_ms, cold_queries = call(events[0])
+    for event in events[1:1 + config['warmup']]:
+        call(event)
+
+    with ThreadPoolExecutor(max_workers=config['concurrency']) as executor:
+        t = time.perf_counter()
+        samples = list(executor.map(call, events))
+        duration = time.perf_counter() - t
+
+    statuses = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [ms for _, ms, _ in samples]
+    queries = [q for _, _, q in samples]
+    result = {
+        'function': config['function'],
+        'requests': len(samples),
+        'concurrency': config['concurrency'],
+        'statuses': statuses,
+        'errors': sum(n for s, n in statuses.items() if not s.isdigit() or int(s) >= 500),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(samples) / duration, 1) if duration else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'max': round(max(latencies), 3)
+        },
+        'db_queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 3),
+            'max': max(queries)
+        },
+        'cold': {'import_ms': round(import_ms, 3), 'first_call_ms': round(cold_ms, 3),
+                 'status': cold_status, 'db_queries': cold_queries}
+    }
+    if 'db' in sys.modules:
+        result['db_pool'] = sys.modules['db'].stats()
+    return result
+
+
+# --- Управляющий процесс ---
+
+def run_scenario(scenario: str, events: list, env: dict, args) -> dict:
+    config = {
+        'function': SCENARIOS[scenario],
+        'events': events,
+        'concurrency': args.concurrency,
+        'warmup': args.warmup,
+        'revalidate': args.revalidate,
+        'seed': args.seed
+    }
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker'],
+        input=json.dumps(config), env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else 'exit %d' % proc.returncode}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(args) -> dict:
+    import seed_db
+    import stub_upstream
+    import psycopg2
+
+    if args.seed_db:
+        seed_db.seed(args.dsn, args.reset, args.cities, users=args.users)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        names = seed_db.sample_city_names(conn, 500, args.seed)
+        users = seed_db.count_users(conn)
+    finally:
+        conn.close()
+    if not names or not users:
+        raise SystemExit('БД пуста: запустите с --seed-db или bench/seed_db.py')
+
+    stub = stub_upstream.start(latency_ms=args.upstream_latency_ms)
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.dsn,
+        MAIN_DB_SCHEMA=seed_db.SCHEMA,
+        OPENWEATHER_API_KEY='bench',
+        OPENWEATHER_URL=stub.url,
+        YANDEX_OAUTH_URL=stub.url,
+        YANDEX_LOGIN_URL=stub.url,
+        PYTHONDONTWRITEBYTECODE='1'
+    )
+    env.setdefault('DB_POOL_MAX', str(args.concurrency))
+
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            rng = random.Random(f'{args.seed}:{scenario}')
+            events = build_events(scenario, args.requests + args.warmup + 1, names, users, rng)
+            upstream_before = stub.requests
+            results[scenario] = run_scenario(scenario, events, env, args)
+            if 'error' not in results[scenario]:
+                results[scenario]['upstream_calls'] = stub.requests - upstream_before
+    finally:
+        stub.shutdown()
+    return results
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    problems = []
+    for scenario, current in results.items():
+        before = baseline.get(scenario)
+        if not before or 'error' in before or 'error' in current:
+            continue
+        old, new = before['latency_ms']['p95'], current['latency_ms']['p95']
+        if new > old * (1 + max_regression / 100):
+            problems.append(f'{scenario} p95: {old} → {new} мс')
+        old, new = before['throughput_rps'], current['throughput_rps']
+        if new < old * (1 - max_regression / 100):
+            problems.append(f'{scenario} пропускная способность: {old} → {new} rps')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--seed-db', action='store_true', help='применить миграции и заполнить БД')
+    parser.add_argument('--reset', action='store_true')
+    parser.add_argument('--cities', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--revalidate', type=float, default=0.3,
+                        help='доля запросов с If-None-Match, когда ETag уже известен')
+    parser.add_argument('--upstream-latency-ms', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--save')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, default=20.0)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(json.load(sys.stdin))))
+        return
+    if not args.dsn:
+        parser.error('нужен --dsn или BENCH_DATABASE_URL')
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps({'benchmark': 'load', 'results': results}, ensure_ascii=False))
+    else:
+        print(f"{'сценарий':>17} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'БД/запр':>8}  ошибки / статусы")
+        for scenario, r in results.items():
+            if 'error' in r:
+                print(f"{scenario:>17} {'—':>8}  ошибка: {r['error']}")
+                continue
+            lat = r['latency_ms']
+            statuses = ', '.join(f'{k}: {v}' for k, v in sorted(r['statuses'].items()))
+            print(f"{scenario:>17} {r['throughput_rps']:>8} {lat['p50']:>8} {lat['p95']:>8} {lat['p99']:>8} "
+                  f"{r['db_queries_per_request']['mean']:>8}  {r['errors']} / {statuses}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        for problem in problems:
+            print('регрессия:', problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
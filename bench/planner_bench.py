@@ -0,0 +1,77 @@
+'''Бенчмарк планировщика встреч: время от числа городов и длины диапазона.
+
+Запуск из корня репозитория:
+    python bench/planner_bench.py [--json]
+
+Таблицы переходов прогреваются заранее, замеряется только planner.plan().
+Если сложность линейна по города × дни, колонка «мкс на город-день»
+остаётся примерно постоянной.
+'''
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from zoneinfo import ZoneInfo, available_timezones
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'cities'))
+
+import planner  # noqa: E402
+
+CITY_COUNTS = (10, 20, 30, 60)
+RANGE_DAYS = (7, 14, 28, 56, 112)
+REPEATS = 5
+HOURS = {'start': '07:00', 'end': '23:00'}
+
+
+def pick_zones(count: int) -> list:
+    '''Пояса с близкими смещениями, чтобы пересечение рабочих часов не было пустым'''
+    from datetime import datetime
+    probe = datetime(2026, 1, 15, 12)
+    zones = []
+    for name in sorted(available_timezones()):
+        if '/' not in name or name.startswith(('Etc/', 'SystemV/')):
+            continue
+        offset = ZoneInfo(name).utcoffset(probe).total_seconds() / 3600
+        if 0 <= offset <= 3:
+            zones.append(name)
+        if len(zones) == count:
+            break
+    return zones
+
+
+def run() -> list:
+    first = date(2026, 2, 2)
+    results = []
+    for cities in CITY_COUNTS:
+        targets = [{'timezone': tz} for tz in pick_zones(cities)]
+        for days in RANGE_DAYS:
+            last = (first + timedelta(days=days - 1)).isoformat()
+            planner.plan(targets, first.isoformat(), last, HOURS)
+            best = float('inf')
+            for _ in range(REPEATS):
+                started = time.perf_counter()
+                result = planner.plan(targets, first.isoformat(), last, HOURS)
+                best = min(best, time.perf_counter() - started)
+            results.append({
+                'cities': len(targets),
+                'days': days,
+                'ms': round(best * 1000, 3),
+                'us_per_city_day': round(best * 1e6 / (len(targets) * days), 2),
+                'slots': result['total_slots']
+            })
+    return results
+
+
+def main():
+    results = run()
+    if '--json' in sys.argv:
+        print(json.dumps({'benchmark': 'planner', 'results': results}))
+        return
+    print(f"{'города':>7} {'дни':>5} {'мс':>9} {'мкс на город-день':>18} {'слоты':>6}")
+    for r in results:
+        print(f"{r['cities']:>7} {r['days']:>5} {r['ms']:>9} {r['us_per_city_day']:>18} {r['slots']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+'''Локальная БД для нагрузочного бенчмарка: схема из db_migrations и синтетические данные.
+
+Запуск из корня репозитория:
+    python bench/seed_db.py --dsn postgresql://localhost/bench [--reset] [--cities 20000] [--users 5000]
+
+Миграции применяются по порядку номеров, затем справочник дополняется
+синтетическими странами и городами с реальными часовыми поясами, а
+пользователи получают настройки, действующие сессии с токенами
+bench-token-<id> и избранное. Генерация детерминирована (--seed).
+'''
+import argparse
+import os
+import random
+import re
+from zoneinfo import available_timezones
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+SCHEMA = 't_p61343402_world_time_app'
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_migrations')
+
+SYLLABLES = ('ка', 'ро', 'ми', 'на', 'ле', 'то', 'ва', 'ск', 'бо', 'ре', 'ди', 'ан',
+             'ос', 'ур', 'ел', 'за', 'пе', 'гра', 'дон', 'вол', 'сев', 'юг', 'бер', 'лин')
+SUFFIXES = ('', 'ск', 'бург', 'град', 'ово', 'ин', 'поль', 'ань')
+WEATHER_CITIES = ('Москва', 'Санкт-Петербург', 'Лондон', 'Париж', 'Токио', 'Нью-Йорк')
+
+
+def token_for(user_id: int) -> str:
+    return f'bench-token-{user_id}'
+
+
+def phone_for(user_id: int) -> str:
+    return f'+7999{user_id:07d}'
+
+
+def apply_migrations(conn, reset: bool):
+    cur = conn.cursor()
+    if reset:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+    files = sorted(
+        (f for f in os.listdir(MIGRATIONS) if re.match(r'V\d+__.*\.sql$', f)),
+        key=lambda f: int(f[1:f.index('__')])
+    )
+    for name in files:
+        with open(os.path.join(MIGRATIONS, name), encoding='utf-8') as f:
+            cur.execute(f.read())
+        print(f'  {name}')
+    conn.commit()
+    cur.close()
+
+
+def city_name(rng: random.Random) -> str:
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) + rng.choice(SUFFIXES)
+    if rng.random() < 0.1:
+        name += '-' + ''.join(rng.choice(SYLLABLES) for _ in range(2))
+    return name.capitalize()
+
+
+def seed_catalog(conn, rng: random.Random, cities: int, countries: int):
+    zones = sorted(z for z in available_timezones() if '/' in z and not z.startswith(('Etc/', 'SystemV/')))
+    cur = conn.cursor()
+    codes = [f'Q{a}{b}' for a in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' for b in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'][:countries]
+    execute_values(
+        cur,
+        f'INSERT INTO {SCHEMA}.countries (name, code) VALUES %s ON CONFLICT (code) DO NOTHING',
+        [(city_name(rng) + 'ия', code) for code in codes]
+    )
+    cur.execute(f'SELECT id FROM {SCHEMA}.countries')
+    country_ids = [row[0] for row in cur.fetchall()]
+
+    cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.cities')
+    missing = max(0, cities - cur.fetchone()[0])
+    rows = [
+        (rng.choice(country_ids), city_name(rng), rng.choice(zones), rng.random() < 0.02,
+         round(rng.uniform(-60, 70), 6), round(rng.uniform(-180, 180), 6))
+        for _ in range(missing)
+    ]
+    execute_values(
+        cur,
+        f'INSERT INTO {SCHEMA}.cities (country_id, name, timezone, is_capital, latitude, longitude) VALUES %s',
+        rows, page_size=1000
+    )
+    conn.commit()
+    cur.close()
+    print(f'  справочник: +{len(codes)} стран, +{missing} городов')
+
+
+def seed_users(conn, rng: random.Random, users: int, max_favorites: int):
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        f'INSERT INTO {SCHEMA}.users (id, phone, first_name, last_name) VALUES %s ON CONFLICT DO NOTHING',
+        [(i, phone_for(i), 'Бенч', f'Пользователь {i}') for i in range(1, users + 1)],
+        page_size=1000
+    )
+    cur.execute(f"SELECT setval(pg_get_serial_sequence('{SCHEMA}.users', 'id'), GREATEST(MAX(id), 1)) FROM {SCHEMA}.users")
+    execute_values(
+        cur,
+        f'INSERT INTO {SCHEMA}.user_settings (user_id, weather_city) VALUES %s ON CONFLICT (user_id) DO NOTHING',
+        [(i, rng.choice(WEATHER_CITIES)) for i in range(1, users + 1)],
+        page_size=1000
+    )
+    execute_values(
+        cur,
+        f"INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at) VALUES %s ON CONFLICT (token) DO NOTHING",
+        [(i, token_for(i)) for i in range(1, users + 1)],
+        template="(%s, %s, NOW() + INTERVAL '30 days')",
+        page_size=1000
+    )
+    cur.execute(f'SELECT id FROM {SCHEMA}.cities')
+    city_ids = [row[0] for row in cur.fetchall()]
+    favorites = []
+    for i in range(1, users + 1):
+        for position, city_id in enumerate(rng.sample(city_ids, rng.randint(0, max_favorites)), 1):
+            favorites.append((i, city_id, position))
+    execute_values(
+        cur,
+        f'INSERT INTO {SCHEMA}.user_favorites (user_id, city_id, position) VALUES %s '
+        f'ON CONFLICT (user_id, city_id) DO NOTHING',
+        favorites, page_size=1000
+    )
+    conn.commit()
+    cur.close()
+    print(f'  пользователи: {users}, избранных: {len(favorites)}')
+
+
+def sample_city_names(conn, count: int, seed: int) -> list:
+    '''Названия городов для сценария поиска, в случайном, но воспроизводимом порядке'''
+    cur = conn.cursor()
+    cur.execute(f'SELECT name FROM {SCHEMA}.cities ORDER BY md5(name || %s) LIMIT %s', (str(seed), count))
+    names = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.rollback()
+    return names
+
+
+def count_users(conn) -> int:
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.sessions WHERE token LIKE 'bench-token-%'")
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.rollback()
+    return count
+
+
+def seed(dsn: str, reset: bool = False, cities: int = 20000, countries: int = 200, users: int = 5000,
+         max_favorites: int = 15, seed_value: int = 42):
+    rng = random.Random(seed_value)
+    conn = psycopg2.connect(dsn)
+    try:
+        print('миграции:')
+        apply_migrations(conn, reset)
+        print('данные:')
+        seed_catalog(conn, rng, cities, countries)
+        seed_users(conn, rng, users, max_favorites)
+        cur = conn.cursor()
+        cur.execute('ANALYZE')
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--reset', action='store_true', help='удалить схему перед миграциями')
+    parser.add_argument('--cities', type=int, default=20000)
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--max-favorites', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('нужен --dsn или BENCH_DATABASE_URL')
+    seed(args.dsn, args.reset, args.cities, args.countries, args.users, args.max_favorites, args.seed)
+
+
+if __name__ == '__main__':
+    main()
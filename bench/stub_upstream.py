@@ -0,0 +1,89 @@
+'''Заглушка OpenWeatherMap и Яндекс OAuth для нагрузочного бенчмарка.
+
+Отвечает в формате настоящих API с настраиваемой задержкой:
+    GET  /data/2.5/weather  — погода
+    POST /token             — обмен кода на access_token
+    GET  /info              — профиль пользователя Яндекса
+
+Функции направляются сюда переменными OPENWEATHER_URL, YANDEX_OAUTH_URL и
+YANDEX_LOGIN_URL. Отдельный запуск: python bench/stub_upstream.py --port 8085
+'''
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload: dict, status: int = 200):
+        time.sleep(self.latency)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/data/2.5/weather':
+            seed = zlib.crc32((query.get('q') or f"{query.get('lat')},{query.get('lon')}").encode('utf-8'))
+            self._reply({
+                'weather': [{'main': ('Clear', 'Clouds', 'Rain', 'Snow')[seed % 4], 'description': 'заглушка'}],
+                'main': {'temp': seed % 40 - 10, 'humidity': seed % 100},
+                'wind': {'speed': seed % 15}
+            })
+        elif url.path == '/info':
+            token = self.headers.get('Authorization', '').replace('OAuth ', '')
+            yandex_id = str(zlib.crc32(token.encode('utf-8')))
+            self._reply({'id': yandex_id, 'first_name': 'Яндекс', 'last_name': yandex_id,
+                         'default_phone': {'number': f'+7998{int(yandex_id) % 10 ** 7:07d}'}})
+        else:
+            self._reply({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        if urlparse(self.path).path == '/token':
+            self._reply({'access_token': f"stub-{form.get('code', '')}", 'expires_in': 3600})
+        else:
+            self._reply({'error': 'not found'}, 404)
+
+
+def start(port: int = 0, latency_ms: float = 50) -> ThreadingHTTPServer:
+    '''Запускает сервер в фоновом потоке; адрес — server.url'''
+    handler = type('Handler', (StubHandler,), {'latency': latency_ms / 1000})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    args = parser.parse_args()
+    server = start(args.port, args.latency_ms)
+    print(f'заглушка слушает {server.url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+-- Префиксные индексы для поиска по началу названия (LIKE 'запрос%')
+CREATE INDEX IF NOT EXISTS idx_cities_name_lower_prefix ON t_p61343402_world_time_app.cities (LOWER(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_countries_name_lower_prefix ON t_p61343402_world_time_app.countries (LOWER(name) text_pattern_ops);
+
+-- Индекс под порядок выдачи по умолчанию: столицы, затем по имени
+CREATE INDEX IF NOT EXISTS idx_cities_capital_name ON t_p61343402_world_time_app.cities (is_capital DESC, name, id);
+
+-- Триграммы для поиска по подстроке и нечёткого поиска, если расширение доступно
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm недоступен, нечёткий поиск отключён';
+END $$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_cities_name_trgm ON t_p61343402_world_time_app.cities USING gin (LOWER(name) gin_trgm_ops)';
+        EXECUTE 'CREATE INDEX IF NOT EXISTS idx_countries_name_trgm ON t_p61343402_world_time_app.countries USING gin (LOWER(name) gin_trgm_ops)';
+    END IF;
+END $$;
@@ -0,0 +1,28 @@
+-- Версия справочника городов и стран: меняется при любом изменении таблиц
+CREATE TABLE IF NOT EXISTS t_p61343402_world_time_app.catalog_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p61343402_world_time_app.catalog_version (id) VALUES (1)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p61343402_world_time_app.bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE t_p61343402_world_time_app.catalog_version
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cities_catalog_version ON t_p61343402_world_time_app.cities;
+CREATE TRIGGER trg_cities_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON t_p61343402_world_time_app.cities
+FOR EACH STATEMENT EXECUTE FUNCTION t_p61343402_world_time_app.bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_countries_catalog_version ON t_p61343402_world_time_app.countries;
+CREATE TRIGGER trg_countries_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON t_p61343402_world_time_app.countries
+FOR EACH STATEMENT EXECUTE FUNCTION t_p61343402_world_time_app.bump_catalog_version();
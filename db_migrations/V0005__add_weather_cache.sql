@@ -0,0 +1,6 @@
+-- Общий кэш ответов OpenWeatherMap для всех экземпляров функции weather
+CREATE TABLE IF NOT EXISTS t_p61343402_world_time_app.weather_cache (
+    city_key VARCHAR(100) PRIMARY KEY,
+    payload TEXT NOT NULL,
+    fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,3 @@
+-- Индексы для очистки просроченных сессий и ограничения числа сессий на пользователя
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON t_p61343402_world_time_app.sessions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_expires ON t_p61343402_world_time_app.sessions(user_id, expires_at DESC);
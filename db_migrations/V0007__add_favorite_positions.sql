@@ -0,0 +1,4 @@
+-- Порядок избранных городов, заданный пользователем
+ALTER TABLE t_p61343402_world_time_app.user_favorites ADD COLUMN IF NOT EXISTS position INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_user_favorites_user_position ON t_p61343402_world_time_app.user_favorites(user_id, position);
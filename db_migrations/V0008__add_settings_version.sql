@@ -0,0 +1,2 @@
+-- Версия настроек пользователя: растёт при каждом изменении, из неё строится ETag
+ALTER TABLE t_p61343402_world_time_app.user_settings ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
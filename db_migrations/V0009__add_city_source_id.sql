@@ -0,0 +1,9 @@
+-- Внешний идентификатор города (например, geonameid) для повторяемого массового импорта
+ALTER TABLE t_p61343402_world_time_app.cities ADD COLUMN IF NOT EXISTS source_id BIGINT;
+
+DO $$
+BEGIN
+    ALTER TABLE t_p61343402_world_time_app.cities ADD CONSTRAINT cities_source_id_key UNIQUE (source_id);
+EXCEPTION WHEN duplicate_table OR duplicate_object THEN
+    NULL;
+END $$;
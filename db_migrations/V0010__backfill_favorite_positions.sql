@@ -0,0 +1,11 @@
+-- Позиции избранного, добавленного до V0007: вслед за уже упорядоченными, в порядке добавления
+UPDATE t_p61343402_world_time_app.user_favorites f
+SET position = o.position
+FROM (
+    SELECT uf.id,
+           COALESCE(MAX(uf.position) OVER (PARTITION BY uf.user_id), 0)
+           + ROW_NUMBER() OVER (PARTITION BY uf.user_id, uf.position IS NULL ORDER BY uf.created_at, uf.id) AS position,
+           uf.position IS NULL AS missing
+    FROM t_p61343402_world_time_app.user_favorites uf
+) o
+WHERE f.id = o.id AND o.missing;
@@ -0,0 +1,10 @@
+-- Собранный снимок справочника (backend/cities/snapshot.py): функции скачивают его при смене catalog_version
+CREATE TABLE IF NOT EXISTS t_p61343402_world_time_app.catalog_snapshot (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL,
+    data BYTEA NOT NULL,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Без сжатия substring() читает кусок снимка, не распаковывая значение целиком
+ALTER TABLE t_p61343402_world_time_app.catalog_snapshot ALTER COLUMN data SET STORAGE EXTERNAL;
@@ -89,6 +89,7 @@ export function SettingsSheet({ open, onOpenChange, user, onProfileUpdate }: Set
   };
 
   const handleLogout = () => {
+    api.auth.logout().catch(console.error);
     localStorage.removeItem('auth_token');
     onProfileUpdate();
     onOpenChange(false);
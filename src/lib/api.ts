@@ -9,6 +9,81 @@ const API_ENDPOINTS = {
 
 const getToken = () => localStorage.getItem('auth_token');
 
+// Листание справочника в NDJSON: города отдаются в onCities по мере разбора тела, страницы — по next_cursor
+const streamCities = async (query: string, onCities?: (cities: any[]) => void) => {
+  const all: any[] = [];
+  let cursor: string | null = '';
+  while (cursor !== null) {
+    const res = await fetch(
+      `${API_BASE}/${API_ENDPOINTS.cities}?${query}&format=ndjson${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`
+    );
+    if (!res.ok || !res.body) {
+      throw new Error(`cities: ${res.status}`);
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    cursor = null;
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffer += decoder.decode(value, { stream: !done });
+      const lines = buffer.split('\n');
+      buffer = done ? '' : lines.pop() ?? '';
+      const batch: any[] = [];
+      for (const line of lines) {
+        if (!line) continue;
+        const item = JSON.parse(line);
+        if ('next_cursor' in item) {
+          cursor = item.next_cursor;
+        } else {
+          batch.push(item);
+        }
+      }
+      if (batch.length) {
+        all.push(...batch);
+        onCities?.(batch);
+      }
+      if (done) break;
+    }
+  }
+  return { cities: all };
+};
+
+// Изменения настроек копятся SETTINGS_FLUSH_MS и уходят одним PATCH с известной версией
+const SETTINGS_FLUSH_MS = 400;
+let settingsVersion: number | undefined;
+let pendingSettings: Record<string, unknown> = {};
+let pendingFlush: Promise<any> | null = null;
+
+const patchSettings = async (changes: Record<string, unknown>, version?: number) => {
+  const token = getToken();
+  const res = await fetch(`${API_BASE}/${API_ENDPOINTS.settings}`, {
+    method: 'PATCH',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${token}`
+    },
+    body: JSON.stringify({
+      version,
+      ops: Object.entries(changes).map(([field, value]) => ({ op: 'replace', path: `/${field}`, value }))
+    })
+  });
+  return { status: res.status, data: await res.json() };
+};
+
+const flushSettings = async () => {
+  const changes = pendingSettings;
+  pendingSettings = {};
+  pendingFlush = null;
+  let { status, data } = await patchSettings(changes, settingsVersion);
+  if (status === 409) {
+    // Настройки поменяли на другом устройстве: накладываем свои поля на свежую версию
+    ({ status, data } = await patchSettings(changes, data.version));
+  }
+  if (data.version !== undefined) settingsVersion = data.version;
+  return data;
+};
+
 export const api = {
   auth: {
     register: async (phone: string, firstName: string, lastName: string) => {
@@ -38,6 +113,19 @@ export const api = {
       return res.json();
     },
     
+    logout: async () => {
+      const token = getToken();
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.auth}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: JSON.stringify({ action: 'logout' })
+      });
+      return res.json();
+    },
+    
     getProfile: async () => {
       const token = getToken();
       const res = await fetch(`${API_BASE}/${API_ENDPOINTS.auth}`, {
@@ -64,6 +152,15 @@ export const api = {
     get: async (city: string) => {
       const res = await fetch(`${API_BASE}/${API_ENDPOINTS.weather}?city=${encodeURIComponent(city)}`);
       return res.json();
+    },
+    
+    getMany: async (cityIds: number[]) => {
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.weather}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ city_ids: cityIds })
+      });
+      return res.json();
     }
   },
   
@@ -73,8 +170,47 @@ export const api = {
       return res.json();
     },
     
-    getByCountry: async (country: string) => {
-      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}?country=${encodeURIComponent(country)}`);
+    getByCountry: (country: string, onCities?: (cities: any[]) => void) =>
+      streamCities(`country=${encodeURIComponent(country)}`, onCities),
+    
+    listAll: (onCities?: (cities: any[]) => void) => streamCities('', onCities),
+    
+    convert: async (timestamps: (string | number)[], cityIds: number[], fromTimezone?: string) => {
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'convert', timestamps, city_ids: cityIds, from_timezone: fromTimezone })
+      });
+      return res.json();
+    },
+    
+    plan: async (cityIds: number[], dateFrom: string, dateTo: string, durationMinutes = 30) => {
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'plan', city_ids: cityIds, date_from: dateFrom, date_to: dateTo, duration_minutes: durationMinutes })
+      });
+      return res.json();
+    },
+    
+    nearby: async (lat: number, lon: number, k = 5) => {
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}?lat=${lat}&lon=${lon}&k=${k}`);
+      return res.json();
+    },
+    
+    bootstrap: async () => {
+      const token = getToken();
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}?bootstrap=1`, {
+        headers: token ? { 'Authorization': `Bearer ${token}` } : {}
+      });
+      return res.json();
+    },
+    
+    getFavorites: async () => {
+      const token = getToken();
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}?favorites=1&with_time=1`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
       return res.json();
     },
     
@@ -89,29 +225,50 @@ export const api = {
         body: JSON.stringify({ city_id: cityId })
       });
       return res.json();
-    }
-  },
-  
-  settings: {
-    get: async () => {
+    },
+    
+    removeFavorite: async (cityId: number) => {
       const token = getToken();
-      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.settings}`, {
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}?city_id=${cityId}`, {
+        method: 'DELETE',
         headers: { 'Authorization': `Bearer ${token}` }
       });
       return res.json();
     },
     
-    update: async (settings: any) => {
+    reorderFavorites: async (cityIds: number[]) => {
       const token = getToken();
-      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.settings}`, {
-        method: 'PUT',
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.cities}`, {
+        method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${token}`
         },
-        body: JSON.stringify(settings)
+        body: JSON.stringify({ action: 'reorder', city_ids: cityIds })
       });
       return res.json();
     }
+  },
+  
+  settings: {
+    get: async () => {
+      const token = getToken();
+      // Версия, которую мы уже записали: сервер не отдаст более старую копию с реплики
+      const query = settingsVersion !== undefined ? `?min_version=${settingsVersion}` : '';
+      const res = await fetch(`${API_BASE}/${API_ENDPOINTS.settings}${query}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      const data = await res.json();
+      if (data.version !== undefined) settingsVersion = data.version;
+      return data;
+    },
+    
+    update: (settings: Record<string, unknown>) => {
+      pendingSettings = { ...pendingSettings, ...settings };
+      if (!pendingFlush) {
+        pendingFlush = new Promise(resolve => setTimeout(resolve, SETTINGS_FLUSH_MS)).then(flushSettings);
+      }
+      return pendingFlush;
+    }
   }
 };
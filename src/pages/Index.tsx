@@ -44,9 +44,7 @@ const Index = () => {
   useEffect(() => {
     const theme = getCurrentTheme();
     applyTheme(theme);
-    checkAuth();
-    loadCities();
-    loadWeather();
+    bootstrap();
   }, []);
 
   useEffect(() => {
@@ -71,6 +69,39 @@ const Index = () => {
     }
   }, [searchQuery, allCities]);
 
+  const bootstrap = async () => {
+    try {
+      const data = await api.cities.bootstrap();
+      if (data.error && localStorage.getItem('auth_token')) {
+        localStorage.removeItem('auth_token');
+        return bootstrap();
+      }
+      if (data.profile) {
+        setUser(data.profile);
+        setIsAuthenticated(true);
+      }
+      const favoriteIds = new Set((data.favorites || []).map((c: CityData) => c.id));
+      const list = (data.cities || []).map((c: CityData) => ({ ...c, isFavorite: favoriteIds.has(c.id) }));
+      const missing = (data.favorites || [])
+        .filter((c: CityData) => !list.some((l: CityData) => l.id === c.id))
+        .map((c: CityData) => ({ ...c, isFavorite: true }));
+      setAllCities([...list, ...missing]);
+      setCities([...list, ...missing].slice(0, 20));
+      const city = data.settings?.weather_city || weatherCity;
+      setWeatherCity(city);
+      if (data.weather) {
+        setWeather(data.weather);
+      } else {
+        loadWeather(city);
+      }
+    } catch (error) {
+      console.error('Failed to bootstrap', error);
+      checkAuth();
+      loadCities();
+      loadWeather();
+    }
+  };
+
   const checkAuth = async () => {
     const token = localStorage.getItem('auth_token');
     if (token) {
@@ -169,10 +200,15 @@ const Index = () => {
       return;
     }
 
+    const isFavorite = cities.find(c => c.id === cityId)?.isFavorite;
     try {
-      await api.cities.addFavorite(cityId);
+      if (isFavorite) {
+        await api.cities.removeFavorite(cityId);
+      } else {
+        await api.cities.addFavorite(cityId);
+      }
       setCities(cities.map(c => c.id === cityId ? { ...c, isFavorite: !c.isFavorite } : c));
-      toast({ title: 'Добавлено в избранное!' });
+      toast({ title: isFavorite ? 'Удалено из избранного' : 'Добавлено в избранное!' });
     } catch (error) {
       toast({ title: 'Ошибка при сохранении', variant: 'destructive' });
     }
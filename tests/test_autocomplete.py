@@ -0,0 +1,58 @@
+'''Постраничный поиск индекса автодополнения: страницы подряд дают тот же
+результат, что и один запрос без ограничения.
+
+Запуск из корня репозитория: python -m unittest discover tests
+'''
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'cities'))
+
+from autocomplete import CityIndex  # noqa: E402
+import snapshot  # noqa: E402
+
+
+def walk(index, query: str, limit: int) -> list:
+    rows, cursor = index.search(query, limit)
+    while cursor:
+        page, cursor = index.search(query, limit, cursor)
+        rows += page
+    return rows
+
+
+class PaginationTest(unittest.TestCase):
+    def setUp(self):
+        rows = [(i, f'Город{i}', 'UTC', i == 1, 'Абвгд', 10.0, 20.0) for i in range(1, 6)]
+        rows += [
+            (99, 'ААабвгород', 'Europe/Moscow', False, 'Россия', 55.0, 37.0),
+            (100, 'Абвиль', 'Europe/Paris', False, 'Франция', 50.0, 1.8),
+            (101, 'Новый Абв', 'Europe/Paris', False, 'Франция', 48.0, 2.0)
+        ]
+        self.index = CityIndex(rows, 1)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        snapshot.write_snapshot(self.path, 1, snapshot.compile_index(self.index, 'test'))
+        self.snapshot = snapshot.Snapshot(self.path)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_pages_match_unpaginated_search(self):
+        for index in (self.index, self.snapshot):
+            for query in ('абв', 'абвгд', 'гор', 'аб'):
+                expected, _ = index.search(query, 1000)
+                for limit in (1, 2, 3, 5):
+                    with self.subTest(index=type(index).__name__, query=query, limit=limit):
+                        self.assertEqual(walk(index, query, limit), expected)
+
+    def test_substring_match_ranks_with_country_matches(self):
+        expected, _ = self.index.search('абв', 1000)
+        self.assertIn(self.index.by_id[99], expected[:3])
+        page, _ = self.index.search('абв', 3)
+        self.assertEqual(page, expected[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()